@@ -0,0 +1,129 @@
+"""partition data
+
+Revision ID: 3f9a2c7d8e14
+Revises: e1b6c7085f3a
+Create Date: 2026-10-18 19:42:11.508263
+
+"""
+
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from config import DATA_PARTITION_INTERVAL, DATA_PARTITION_PREMAKE
+from database.partitions import (
+    DEFAULT_PARTITION,
+    create_partition_sql,
+    next_partition_start,
+    partition_ranges,
+    partition_start,
+)
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3f9a2c7d8e14"
+down_revision: Union[str, None] = "e1b6c7085f3a"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def data_columns(date_nullable: bool) -> list[sa.Column]:
+    # The id sequence of the original table is kept, so ids keep growing.
+    return [
+        sa.Column(
+            "id",
+            sa.Integer(),
+            server_default=sa.text("nextval('data_id_seq'::regclass)"),
+            nullable=False,
+        ),
+        sa.Column("x", sa.Float(), nullable=True),
+        sa.Column("y", sa.Float(), nullable=True),
+        sa.Column("z", sa.Float(), nullable=True),
+        sa.Column(
+            "date",
+            sa.DateTime(),
+            server_default=sa.text("now()"),
+            nullable=date_nullable,
+        ),
+        sa.Column("device_id", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(["device_id"], ["devices.id"]),
+    ]
+
+
+def create_data_indexes() -> None:
+    op.create_index(
+        "ix_data_device_id_date",
+        "data",
+        ["device_id", "date"],
+        postgresql_include=["x", "y", "z"],
+    )
+    op.create_index(
+        "ix_data_date", "data", ["date"], postgresql_include=["x", "y", "z"]
+    )
+
+
+def rename_data(new_name: str) -> None:
+    op.rename_table("data", new_name)
+    op.execute(f"ALTER TABLE {new_name} RENAME CONSTRAINT data_pkey TO {new_name}_pkey")
+    op.execute(
+        f"ALTER INDEX ix_data_device_id_date RENAME TO ix_{new_name}_device_id_date"
+    )
+    op.execute(f"ALTER INDEX ix_data_date RENAME TO ix_{new_name}_date")
+
+
+def upgrade() -> None:
+    interval = DATA_PARTITION_INTERVAL
+    rename_data("data_unpartitioned")
+    op.create_table(
+        "data",
+        *data_columns(date_nullable=False),
+        sa.PrimaryKeyConstraint("id", "date"),
+        postgresql_partition_by="RANGE (date)",
+    )
+    create_data_indexes()
+
+    # Partitions from the oldest reading up to DATA_PARTITION_PREMAKE
+    # intervals ahead, plus the default one for anything outside of them.
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    first_date, last_date = (
+        op.get_bind()
+        .execute(sa.text("SELECT min(date), max(date) FROM data_unpartitioned"))
+        .one()
+    )
+    end = partition_start(now, interval)
+    for _ in range(DATA_PARTITION_PREMAKE):
+        end = next_partition_start(end, interval)
+    begin = min(first_date or now, now)
+    end = max(last_date or end, end)
+    for start, stop in partition_ranges(begin, end, interval):
+        op.execute(create_partition_sql(start, stop, interval))
+    op.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF data DEFAULT")
+
+    op.execute(
+        "INSERT INTO data (id, x, y, z, date, device_id) "
+        "SELECT id, x, y, z, coalesce(date, now()), device_id "
+        "FROM data_unpartitioned"
+    )
+    op.execute("ALTER SEQUENCE data_id_seq OWNED BY data.id")
+    op.drop_table("data_unpartitioned")
+    op.execute("ANALYZE data")
+
+
+def downgrade() -> None:
+    rename_data("data_partitioned")
+    op.create_table(
+        "data",
+        *data_columns(date_nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.execute(
+        "INSERT INTO data (id, x, y, z, date, device_id) "
+        "SELECT id, x, y, z, date, device_id FROM data_partitioned"
+    )
+    op.execute("ALTER SEQUENCE data_id_seq OWNED BY data.id")
+    # Drops the partitions too; detached ones stay as standalone tables.
+    op.drop_table("data_partitioned")
+    create_data_indexes()
+    op.execute("ANALYZE data")
@@ -0,0 +1,112 @@
+"""data rollups
+
+Revision ID: 5e27b3d9a6c1
+Revises: c4f81a09d2b7
+Create Date: 2026-10-18 12:26:09.311872
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5e27b3d9a6c1"
+down_revision: Union[str, None] = "c4f81a09d2b7"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BUCKETS = ("minute", "hour", "day")
+
+
+def upgrade() -> None:
+    op.create_table(
+        "data_rollup_minute",
+        sa.Column("device_id", sa.Integer(), nullable=False),
+        sa.Column("bucket", sa.DateTime(), nullable=False),
+        sa.Column("count", sa.BigInteger(), nullable=False),
+        sa.Column("x_min", sa.Float(), nullable=True),
+        sa.Column("x_max", sa.Float(), nullable=True),
+        sa.Column("x_sum", sa.Float(), nullable=True),
+        sa.Column("y_min", sa.Float(), nullable=True),
+        sa.Column("y_max", sa.Float(), nullable=True),
+        sa.Column("y_sum", sa.Float(), nullable=True),
+        sa.Column("z_min", sa.Float(), nullable=True),
+        sa.Column("z_max", sa.Float(), nullable=True),
+        sa.Column("z_sum", sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["device_id"],
+            ["devices.id"],
+        ),
+        sa.PrimaryKeyConstraint("device_id", "bucket"),
+    )
+    op.create_table(
+        "data_rollup_hour",
+        sa.Column("device_id", sa.Integer(), nullable=False),
+        sa.Column("bucket", sa.DateTime(), nullable=False),
+        sa.Column("count", sa.BigInteger(), nullable=False),
+        sa.Column("x_min", sa.Float(), nullable=True),
+        sa.Column("x_max", sa.Float(), nullable=True),
+        sa.Column("x_sum", sa.Float(), nullable=True),
+        sa.Column("y_min", sa.Float(), nullable=True),
+        sa.Column("y_max", sa.Float(), nullable=True),
+        sa.Column("y_sum", sa.Float(), nullable=True),
+        sa.Column("z_min", sa.Float(), nullable=True),
+        sa.Column("z_max", sa.Float(), nullable=True),
+        sa.Column("z_sum", sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["device_id"],
+            ["devices.id"],
+        ),
+        sa.PrimaryKeyConstraint("device_id", "bucket"),
+    )
+    op.create_table(
+        "data_rollup_day",
+        sa.Column("device_id", sa.Integer(), nullable=False),
+        sa.Column("bucket", sa.DateTime(), nullable=False),
+        sa.Column("count", sa.BigInteger(), nullable=False),
+        sa.Column("x_min", sa.Float(), nullable=True),
+        sa.Column("x_max", sa.Float(), nullable=True),
+        sa.Column("x_sum", sa.Float(), nullable=True),
+        sa.Column("y_min", sa.Float(), nullable=True),
+        sa.Column("y_max", sa.Float(), nullable=True),
+        sa.Column("y_sum", sa.Float(), nullable=True),
+        sa.Column("z_min", sa.Float(), nullable=True),
+        sa.Column("z_max", sa.Float(), nullable=True),
+        sa.Column("z_sum", sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["device_id"],
+            ["devices.id"],
+        ),
+        sa.PrimaryKeyConstraint("device_id", "bucket"),
+    )
+
+    for bucket in BUCKETS:
+        op.execute(
+            f"""
+            INSERT INTO data_rollup_{bucket} (
+                device_id, bucket, count,
+                x_min, x_max, x_sum,
+                y_min, y_max, y_sum,
+                z_min, z_max, z_sum
+            )
+            SELECT
+                device_id, date_trunc('{bucket}', date), count(*),
+                min(x), max(x), sum(x),
+                min(y), max(y), sum(y),
+                min(z), max(z), sum(z)
+            FROM data
+            WHERE device_id IS NOT NULL AND date IS NOT NULL
+            GROUP BY device_id, date_trunc('{bucket}', date)
+            """
+        )
+        op.create_index(
+            f"ix_data_rollup_{bucket}_bucket", f"data_rollup_{bucket}", ["bucket"]
+        )
+
+
+def downgrade() -> None:
+    for bucket in reversed(BUCKETS):
+        op.drop_table(f"data_rollup_{bucket}")
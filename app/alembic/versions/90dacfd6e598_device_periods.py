@@ -0,0 +1,47 @@
+"""device periods
+
+Revision ID: 90dacfd6e598
+Revises: 2b1e5c64febc
+Create Date: 2026-10-18 10:12:41.518203
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "90dacfd6e598"
+down_revision: Union[str, None] = "2b1e5c64febc"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "device_periods",
+        sa.Column("device_id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("first_date", sa.DateTime(), nullable=False),
+        sa.Column("last_date", sa.DateTime(), nullable=False),
+        sa.Column("count", sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["device_id"],
+            ["devices.id"],
+        ),
+        sa.PrimaryKeyConstraint("device_id"),
+    )
+    op.execute(
+        """
+        INSERT INTO device_periods (device_id, first_date, last_date, count)
+        SELECT device_id, min(date), max(date), count(*)
+        FROM data
+        WHERE device_id IS NOT NULL AND date IS NOT NULL
+        GROUP BY device_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("device_periods")
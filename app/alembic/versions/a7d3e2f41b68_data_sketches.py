@@ -0,0 +1,66 @@
+"""data sketches
+
+Revision ID: a7d3e2f41b68
+Revises: 5e27b3d9a6c1
+Create Date: 2026-10-18 13:41:52.067314
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from database.sketches import LOG_GAMMA, MIN_VALUE
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a7d3e2f41b68"
+down_revision: Union[str, None] = "5e27b3d9a6c1"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "data_sketches",
+        sa.Column("device_id", sa.Integer(), nullable=False),
+        sa.Column("bucket", sa.DateTime(), nullable=False),
+        sa.Column("column_name", sa.String(length=1), nullable=False),
+        sa.Column("sign", sa.SmallInteger(), nullable=False),
+        sa.Column("bin", sa.Integer(), nullable=False),
+        sa.Column("count", sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["device_id"],
+            ["devices.id"],
+        ),
+        sa.PrimaryKeyConstraint("device_id", "bucket", "column_name", "sign", "bin"),
+    )
+    for column in ("x", "y", "z"):
+        op.execute(
+            f"""
+            INSERT INTO data_sketches (
+                device_id, bucket, column_name, sign, bin, count
+            )
+            SELECT device_id, bucket, '{column}', sign, bin, count(*)
+            FROM (
+                SELECT
+                    device_id,
+                    date_trunc('hour', date) AS bucket,
+                    CASE WHEN abs({column}) < {MIN_VALUE} THEN 0
+                        ELSE sign({column}) END AS sign,
+                    CASE WHEN abs({column}) < {MIN_VALUE} THEN 0
+                        ELSE ceil(ln(abs({column})) / {LOG_GAMMA}) END AS bin
+                FROM data
+                WHERE device_id IS NOT NULL
+                    AND date IS NOT NULL
+                    AND {column} IS NOT NULL
+            ) AS bins
+            GROUP BY device_id, bucket, sign, bin
+            """
+        )
+    op.create_index("ix_data_sketches_bucket", "data_sketches", ["bucket"])
+
+
+def downgrade() -> None:
+    op.drop_table("data_sketches")
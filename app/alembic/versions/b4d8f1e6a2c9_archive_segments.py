@@ -0,0 +1,59 @@
+"""archive segments
+
+Revision ID: b4d8f1e6a2c9
+Revises: 3f9a2c7d8e14
+Create Date: 2026-10-18 20:12:45.318204
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b4d8f1e6a2c9"
+down_revision: Union[str, None] = "3f9a2c7d8e14"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "archive_segments",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("device_id", sa.Integer(), nullable=False),
+        sa.Column("range_start", sa.DateTime(), nullable=False),
+        sa.Column("range_stop", sa.DateTime(), nullable=False),
+        sa.Column("first_date", sa.DateTime(), nullable=False),
+        sa.Column("last_date", sa.DateTime(), nullable=False),
+        sa.Column("count", sa.BigInteger(), nullable=False),
+        sa.Column("x_min", sa.Float(), nullable=True),
+        sa.Column("x_max", sa.Float(), nullable=True),
+        sa.Column("x_sum", sa.Float(), nullable=True),
+        sa.Column("y_min", sa.Float(), nullable=True),
+        sa.Column("y_max", sa.Float(), nullable=True),
+        sa.Column("y_sum", sa.Float(), nullable=True),
+        sa.Column("z_min", sa.Float(), nullable=True),
+        sa.Column("z_max", sa.Float(), nullable=True),
+        sa.Column("z_sum", sa.Float(), nullable=True),
+        sa.Column("path", sa.String(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["device_id"],
+            ["devices.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_archive_segments_device_id_first_date",
+        "archive_segments",
+        ["device_id", "first_date"],
+    )
+    op.create_index(
+        "ix_archive_segments_range_stop", "archive_segments", ["range_stop"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("archive_segments")
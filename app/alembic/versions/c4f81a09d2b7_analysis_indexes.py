@@ -0,0 +1,55 @@
+"""analysis indexes
+
+Revision ID: c4f81a09d2b7
+Revises: 90dacfd6e598
+Create Date: 2026-10-18 11:03:27.904116
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c4f81a09d2b7"
+down_revision: Union[str, None] = "90dacfd6e598"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY keeps ingest running while the indexes are built,
+    # but it cannot run inside the migration transaction.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_data_device_id_date",
+            "data",
+            ["device_id", "date"],
+            postgresql_include=["x", "y", "z"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_data_date",
+            "data",
+            ["date"],
+            postgresql_include=["x", "y", "z"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_devices_user_id",
+            "devices",
+            ["user_id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+    op.execute("ANALYZE data")
+    op.execute("ANALYZE devices")
+
+
+def downgrade() -> None:
+    op.drop_index("ix_devices_user_id", table_name="devices")
+    op.drop_index("ix_data_date", table_name="data")
+    op.drop_index("ix_data_device_id_date", table_name="data")
@@ -0,0 +1,61 @@
+"""archive sketches
+
+Revision ID: d2c5a8f3e17b
+Revises: b4d8f1e6a2c9
+Create Date: 2026-10-19 10:24:06.581937
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from config import ARCHIVE_DIR
+from database.archive import read_segment_array
+from database.rollups import COLUMNS
+from database.sketches import sketch_bin_counts
+
+
+# revision identifiers, used by Alembic.
+revision: str = "d2c5a8f3e17b"
+down_revision: Union[str, None] = "b4d8f1e6a2c9"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    archive_sketches = op.create_table(
+        "archive_sketches",
+        sa.Column("segment_id", sa.Integer(), nullable=False),
+        sa.Column("column_name", sa.String(length=1), nullable=False),
+        sa.Column("sign", sa.SmallInteger(), nullable=False),
+        sa.Column("bin", sa.Integer(), nullable=False),
+        sa.Column("count", sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["segment_id"], ["archive_segments.id"], ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("segment_id", "column_name", "sign", "bin"),
+    )
+    # Segments archived before this revision get their sketches from the
+    # segment files, one segment at a time.
+    segments = op.get_bind().execute(sa.text("SELECT id, path FROM archive_segments"))
+    for segment_id, path in segments.all():
+        rows = []
+        for column in COLUMNS:
+            values = read_segment_array(ARCHIVE_DIR, path, column)
+            rows += [
+                {
+                    "segment_id": segment_id,
+                    "column_name": column,
+                    "sign": sign,
+                    "bin": bin,
+                    "count": count,
+                }
+                for sign, bin, count in sketch_bin_counts(values)
+            ]
+        op.bulk_insert(archive_sketches, rows)
+
+
+def downgrade() -> None:
+    op.drop_table("archive_sketches")
@@ -0,0 +1,30 @@
+"""device period backfills
+
+Revision ID: e1b6c7085f3a
+Revises: a7d3e2f41b68
+Create Date: 2026-10-18 15:07:33.482915
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e1b6c7085f3a"
+down_revision: Union[str, None] = "a7d3e2f41b68"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "device_periods",
+        sa.Column("backfills", sa.BigInteger(), server_default="0", nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("device_periods", "backfills")
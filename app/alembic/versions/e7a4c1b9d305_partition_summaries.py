@@ -0,0 +1,115 @@
+"""partition summaries
+
+Revision ID: e7a4c1b9d305
+Revises: d2c5a8f3e17b
+Create Date: 2026-10-19 16:05:37.214850
+
+"""
+
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from config import DATA_PARTITION_INTERVAL, DATA_PARTITION_PREMAKE
+from database.partitions import (
+    SUMMARIES,
+    create_partition_sql,
+    default_partition,
+    next_partition_start,
+    partition_ranges,
+    partition_start,
+)
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e7a4c1b9d305"
+down_revision: Union[str, None] = "d2c5a8f3e17b"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def summary_columns(table: str) -> list[sa.Column]:
+    columns = [
+        sa.Column("device_id", sa.Integer(), nullable=False),
+        sa.Column("bucket", sa.DateTime(), nullable=False),
+    ]
+    if table == "data_sketches":
+        return columns + [
+            sa.Column("column_name", sa.String(length=1), nullable=False),
+            sa.Column("sign", sa.SmallInteger(), nullable=False),
+            sa.Column("bin", sa.Integer(), nullable=False),
+            sa.Column("count", sa.BigInteger(), nullable=False),
+            sa.ForeignKeyConstraint(["device_id"], ["devices.id"]),
+            sa.PrimaryKeyConstraint(
+                "device_id", "bucket", "column_name", "sign", "bin"
+            ),
+        ]
+    columns.append(sa.Column("count", sa.BigInteger(), nullable=False))
+    for column in ("x", "y", "z"):
+        columns += [
+            sa.Column(f"{column}_min", sa.Float(), nullable=True),
+            sa.Column(f"{column}_max", sa.Float(), nullable=True),
+            sa.Column(f"{column}_sum", sa.Float(), nullable=True),
+        ]
+    return columns + [
+        sa.ForeignKeyConstraint(["device_id"], ["devices.id"]),
+        sa.PrimaryKeyConstraint("device_id", "bucket"),
+    ]
+
+
+def rename_summary(table: str, new_name: str) -> None:
+    op.rename_table(table, new_name)
+    op.execute(
+        f"ALTER TABLE {new_name} RENAME CONSTRAINT {table}_pkey TO {new_name}_pkey"
+    )
+    op.execute(f"ALTER INDEX ix_{table}_bucket RENAME TO ix_{new_name}_bucket")
+
+
+def upgrade() -> None:
+    # The rollups and sketches get the partitions data has, so that the
+    # retention drops them along with the partition of the readings instead
+    # of deleting their rows.
+    interval = DATA_PARTITION_INTERVAL
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    for table in SUMMARIES:
+        rename_summary(table, f"{table}_unpartitioned")
+        op.create_table(
+            table,
+            *summary_columns(table),
+            postgresql_partition_by="RANGE (bucket)",
+        )
+        op.create_index(f"ix_{table}_bucket", table, ["bucket"])
+
+        first_bucket, last_bucket = (
+            op.get_bind()
+            .execute(
+                sa.text(f"SELECT min(bucket), max(bucket) FROM {table}_unpartitioned")
+            )
+            .one()
+        )
+        end = partition_start(now, interval)
+        for _ in range(DATA_PARTITION_PREMAKE):
+            end = next_partition_start(end, interval)
+        begin = min(first_bucket or now, now)
+        end = max(last_bucket or end, end)
+        for start, stop in partition_ranges(begin, end, interval):
+            op.execute(create_partition_sql(start, stop, interval, table))
+        op.execute(
+            f"CREATE TABLE {default_partition(table)} PARTITION OF {table} DEFAULT"
+        )
+
+        op.execute(f"INSERT INTO {table} SELECT * FROM {table}_unpartitioned")
+        op.drop_table(f"{table}_unpartitioned")
+        op.execute(f"ANALYZE {table}")
+
+
+def downgrade() -> None:
+    for table in SUMMARIES:
+        rename_summary(table, f"{table}_partitioned")
+        op.create_table(table, *summary_columns(table))
+        op.execute(f"INSERT INTO {table} SELECT * FROM {table}_partitioned")
+        op.drop_table(f"{table}_partitioned")
+        op.create_index(f"ix_{table}_bucket", table, ["bucket"])
+        op.execute(f"ANALYZE {table}")
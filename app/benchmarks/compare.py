@@ -0,0 +1,78 @@
+import argparse
+import json
+import sys
+
+# Compares two benchmarks.run reports and exits with status 1 if any case got
+# slower than the threshold allows or issues more queries per call:
+#   python -m benchmarks.compare base.json new.json --threshold 0.2
+
+
+def load(path: str) -> dict:
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare(
+    base: dict, new: dict, metric: str, threshold: float, min_delta: float
+) -> list[str]:
+    regressions = []
+    print(f"{'case':32} {'base':>10} {'new':>10} {'change':>8}  queries")
+    for name, base_result in base["results"].items():
+        new_result = new["results"].get(name)
+        if new_result is None:
+            print(f"{name:32} missing in the new report")
+            continue
+        base_value = base_result[metric]
+        new_value = new_result[metric]
+        change = new_value / base_value - 1 if base_value else 0.0
+        base_queries = base_result["queries_per_call"]
+        new_queries = new_result["queries_per_call"]
+        flags = []
+        # Tiny absolute differences are noise even when the ratio is large.
+        if change > threshold and new_value - base_value > min_delta:
+            flags.append(f"{metric} +{change:.0%}")
+        if new_queries > base_queries + 0.01:
+            flags.append(f"queries {base_queries:.2f} -> {new_queries:.2f}")
+        print(
+            f"{name:32} {base_value:10.3f} {new_value:10.3f} {change:+8.1%}"
+            f"  {new_queries:.2f}{'  REGRESSION' if flags else ''}"
+        )
+        if flags:
+            regressions.append(f"{name}: {', '.join(flags)}")
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare benchmark reports.")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument(
+        "--metric",
+        choices=["mean_ms", "p50_ms", "p95_ms", "p99_ms"],
+        default="p95_ms",
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="allowed relative slowdown"
+    )
+    parser.add_argument(
+        "--min-delta", type=float, default=0.5, help="ignore slowdowns below this, ms"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    base = load(args.base)
+    new = load(args.new)
+    if base["meta"]["scale"] != new["meta"]["scale"]:
+        print(
+            f"Reports are of different scales: "
+            f"{base['meta']['scale']} and {new['meta']['scale']}"
+        )
+        sys.exit(2)
+    regressions = compare(base, new, args.metric, args.threshold, args.min_delta)
+    if regressions:
+        print("\nRegressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
@@ -0,0 +1,404 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+# The seeded readings are dated in the past, so retention or the archive
+# would remove them, and periodic partition maintenance would move them
+# while cases are timed. Maintenance runs once after seeding instead.
+os.environ["DATA_RETENTION_DAYS"] = "0"
+os.environ["ARCHIVE_AFTER_DAYS"] = "0"
+os.environ["DATA_PARTITION_MAINTENANCE_INTERVAL"] = "0"
+
+import numpy as np
+from database.base import Base, engine
+from devices.device_simulator import DeviceFleet
+from main import app, db
+from sqlalchemy import event, text
+
+# In-process benchmarks of BaseAccessor methods and endpoints against a local
+# Postgres seeded at a fixed scale. DATABASE_URL must point to a database used
+# only for benchmarks. Run from the app directory:
+#   python -m benchmarks.run --scale 1e5 --output base.json
+# and compare two runs with benchmarks.compare.
+
+
+@dataclass
+class Scale:
+    rows: int
+    users: int
+    devices: int
+
+
+SCALES = {
+    "1e4": Scale(rows=10**4, users=10, devices=100),
+    "1e5": Scale(rows=10**5, users=10, devices=100),
+    "1e6": Scale(rows=10**6, users=100, devices=1000),
+    "1e7": Scale(rows=10**7, users=100, devices=1000),
+}
+# Seeded readings span this period, starting at a fixed date so that every
+# run of a scale sees the same data.
+SEED_START = datetime(2024, 1, 1)
+SEED_SPAN = timedelta(days=30)
+SEED_BATCH_ROWS = 50_000
+SEED = 20240101
+PASSWORD = "bench"
+
+
+@dataclass
+class Case:
+    name: str
+    call: Callable[[], Awaitable]
+    setup: Callable[[], None] = None
+    # Slow cases run a tenth of the iterations.
+    heavy: bool = False
+
+
+class Context:
+    def __init__(self, scale: Scale) -> None:
+        self.rng = random.Random(SEED)
+        self.device_ids = list(range(1, scale.devices + 1))
+        self.user_ids = []
+        self.tokens = []
+        self.begin = SEED_START
+        self.end = SEED_START + SEED_SPAN
+        self.fleet = DeviceFleet(self.device_ids[:10], rate=10, seed=SEED)
+
+    def device_id(self) -> int:
+        return self.rng.choice(self.device_ids)
+
+    def user_id(self) -> int:
+        return self.rng.choice(self.user_ids)
+
+    def token(self) -> str:
+        return self.rng.choice(self.tokens)
+
+    def hour(self) -> tuple[datetime, datetime]:
+        hours = int(SEED_SPAN.total_seconds() // 3600) - 1
+        begin = self.begin + timedelta(hours=self.rng.randrange(hours))
+        return begin, begin + timedelta(hours=1)
+
+
+class QueryCounter:
+    def __init__(self) -> None:
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self.increment)
+        # COPY goes through the raw asyncpg connection, past the engine's
+        # events, so it is counted around the accessor's method instead.
+        copy_data = db.copy_data
+
+        async def counted_copy_data(*args, **kwargs) -> None:
+            self.increment()
+            await copy_data(*args, **kwargs)
+
+        db.copy_data = counted_copy_data
+
+    def increment(self, *args) -> None:
+        self.count += 1
+
+
+async def asgi_request(
+    method: str, path: str, query: str = "", headers: dict = None, body: bytes = b""
+) -> int:
+    # Calls the application directly, without a server or HTTP client.
+    raw_headers = [(b"host", b"benchmark")]
+    for name, value in (headers or {}).items():
+        raw_headers.append((name.lower().encode(), value.encode()))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": raw_headers,
+        "client": ("127.0.0.1", 0),
+        "server": ("benchmark", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    response = {}
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+
+    await app(scope, receive, send)
+    if response["status"] >= 400:
+        raise RuntimeError(f"{method} {path}?{query} -> {response['status']}")
+    return response["status"]
+
+
+async def seed(scale: Scale, fresh: bool) -> int:
+    period = await db.get_data_period()
+    if period and not fresh:
+        return period.count
+    if period:
+        tables = ", ".join(table.name for table in Base.metadata.sorted_tables)
+        async with engine.begin() as conn:
+            await conn.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+        db.principals.clear()
+        db.analysis_cache.clear()
+        await db.registry.refresh()
+
+    devices_per_user = scale.devices // scale.users
+    for user_index in range(scale.users):
+        login = f"bench_{user_index}"
+        user = await db.add_user(login, PASSWORD)
+        if not user:
+            user = await db.get_user(login=login, with_devices=False)
+        first = user_index * devices_per_user + 1
+        for device_id in range(first, first + devices_per_user):
+            await db.add_device(device_id, user.id)
+
+    device_ids = list(range(1, scale.devices + 1))
+    span = SEED_SPAN.total_seconds()
+    fleet = DeviceFleet(
+        device_ids,
+        rate=scale.rows / (scale.devices * span),
+        gap_probability=0.01,
+        seed=SEED,
+        start=SEED_START,
+    )
+    seconds = span * SEED_BATCH_ROWS / scale.rows
+    stored = 0
+    for batch in fleet.batches(seconds, scale.rows):
+        if len(batch):
+            counts, _ = await db.new_data_batch(batch.to_data())
+            stored += sum(counts.values())
+        print(f"seeded {stored} rows", file=sys.stderr)
+    return stored
+
+
+async def prepare(ctx: Context, scale: Scale) -> None:
+    for user_index in range(scale.users):
+        login = f"bench_{user_index}"
+        user = await db.get_user(login=login, with_devices=False)
+        ctx.user_ids.append(user.id)
+        ctx.tokens.append(await db.auth_user(login, PASSWORD))
+
+
+def cases(ctx: Context) -> list[Case]:
+    batches = []
+
+    def next_batch():
+        batches.append(ctx.fleet.batch(1).to_data())
+
+    def cold_analysis():
+        db.analysis_cache.clear()
+
+    async def hour_analysis():
+        begin, end = ctx.hour()
+        return await db.get_analysis(ctx.device_id(), None, None, begin, end)
+
+    def auth() -> dict:
+        return {"Authorization": f"Bearer {ctx.token()}"}
+
+    return [
+        Case(
+            "get_user_by_token",
+            lambda: db.get_user_by_token(ctx.token()),
+        ),
+        Case(
+            "get_user_by_token.cold",
+            lambda: db.get_user_by_token(ctx.token()),
+            setup=db.principals.clear,
+        ),
+        Case("get_device_period", lambda: db.get_device_period(ctx.device_id())),
+        Case("get_user_period", lambda: db.get_user_period(ctx.user_id())),
+        Case("get_total_period", lambda: db.get_total_period()),
+        Case(
+            "get_analysis.device",
+            lambda: db.get_analysis(device_id=ctx.device_id()),
+            setup=cold_analysis,
+        ),
+        Case(
+            "get_analysis.device_approx",
+            lambda: db.get_analysis(device_id=ctx.device_id(), approx=True),
+            setup=cold_analysis,
+        ),
+        Case("get_analysis.device_hour", hour_analysis, setup=cold_analysis),
+        Case(
+            "get_analysis.user",
+            lambda: db.get_analysis(user_id=ctx.user_id()),
+            setup=cold_analysis,
+            heavy=True,
+        ),
+        Case(
+            "get_analysis.all",
+            lambda: db.get_analysis(),
+            setup=cold_analysis,
+            heavy=True,
+        ),
+        Case(
+            "get_analysis.all_approx",
+            lambda: db.get_analysis(approx=True),
+            setup=cold_analysis,
+            heavy=True,
+        ),
+        Case("get_analysis.cached", lambda: db.get_analysis(device_id=1)),
+        Case(
+            "get_devices_analysis.user",
+            lambda: db.get_devices_analysis(user_id=ctx.user_id()),
+            heavy=True,
+        ),
+        Case(
+            "get_series.device",
+            lambda: db.get_series(ctx.device_id(), None, ctx.begin, ctx.end, 500),
+        ),
+        Case(
+            "get_rolling.device_hour",
+            lambda: db.get_rolling(ctx.device_id(), None, None, *ctx.hour(), 60, 60),
+        ),
+        Case("GET /users/me", lambda: asgi_request("GET", "/users/me", headers=auth())),
+        Case(
+            "GET /devices/",
+            lambda: asgi_request("GET", "/devices/"),
+        ),
+        Case(
+            "GET /device_data_analysis/",
+            lambda: asgi_request(
+                "GET", "/device_data_analysis/", f"device_id={ctx.device_id()}"
+            ),
+            setup=cold_analysis,
+        ),
+        # Writes come last so that they do not change the data read above.
+        Case("new_data", lambda: db.new_data(ctx.device_id())),
+        Case(
+            "new_data_batch",
+            lambda: db.new_data_batch(batches.pop()),
+            setup=next_batch,
+        ),
+        Case(
+            "GET /new_device_data/{id}",
+            lambda: asgi_request("GET", f"/new_device_data/{ctx.device_id()}"),
+        ),
+    ]
+
+
+async def measure(
+    case: Case, counter: QueryCounter, iterations: int, warmup: int
+) -> dict:
+    if case.heavy:
+        iterations = max(iterations // 10, 5)
+        warmup = min(warmup, 1)
+    for _ in range(warmup):
+        if case.setup:
+            case.setup()
+        await case.call()
+    timings = []
+    queries = 0
+    for _ in range(iterations):
+        if case.setup:
+            case.setup()
+        count = counter.count
+        start = time.perf_counter()
+        await case.call()
+        timings.append(time.perf_counter() - start)
+        queries += counter.count - count
+    timings = np.array(timings) * 1000
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+    return {
+        "iterations": iterations,
+        "mean_ms": float(timings.mean()),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "queries_per_call": queries / iterations,
+    }
+
+
+def git_commit() -> str:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+async def run(args: argparse.Namespace) -> dict:
+    scale = SCALES[args.scale]
+    await db.registry.refresh()
+    rows = await seed(scale, args.fresh)
+    # Moves the seeded readings out of data_default into their partitions.
+    await db.partitions.maintain()
+    await db.start()
+    ctx = Context(scale)
+    await prepare(ctx, scale)
+    counter = QueryCounter()
+    results = {}
+    try:
+        for case in cases(ctx):
+            if args.only and not any(name in case.name for name in args.only):
+                continue
+            results[case.name] = await measure(
+                case, counter, args.iterations, args.warmup
+            )
+            print(
+                f"{case.name:32} p50 {results[case.name]['p50_ms']:9.3f} ms"
+                f"  p95 {results[case.name]['p95_ms']:9.3f} ms"
+                f"  p99 {results[case.name]['p99_ms']:9.3f} ms"
+                f"  queries {results[case.name]['queries_per_call']:.2f}",
+                file=sys.stderr,
+            )
+    finally:
+        await db.stop()
+        await engine.dispose()
+    return {
+        "meta": {
+            "scale": args.scale,
+            "rows": rows,
+            "users": scale.users,
+            "devices": scale.devices,
+            "iterations": args.iterations,
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "created": datetime.now().isoformat(timespec="seconds"),
+        },
+        "results": results,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark accessor methods.")
+    parser.add_argument("--scale", choices=list(SCALES), default="1e5")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument(
+        "--fresh",
+        action="store_true",
+        help="truncate all tables and seed again even if data exists",
+    )
+    parser.add_argument(
+        "--only", nargs="*", help="run only cases whose name contains one of these"
+    )
+    parser.add_argument("--output", help="write results to this JSON file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(run(args))
+    text_report = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text_report + "\n")
+    else:
+        print(text_report)
@@ -1,6 +1,139 @@
 import os
 
+
+def env_flag(name: str, default: bool = False) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in {"1", "true", "yes", "on"}
+
+
+def cpu_count() -> int:
+    # CPUs this process may run on, which is less than os.cpu_count() when
+    # the container is pinned to a subset of the host's cores.
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
 JWT_SECRET = "some_secret_key"
 JWT_ALGORITHM = "HS256"
+
+# Decoded access tokens are kept with their users for at most this long,
+# and never past the token's own expiry.
+PRINCIPAL_CACHE_SIZE = int(os.environ.get("PRINCIPAL_CACHE_SIZE", 10000))
+PRINCIPAL_CACHE_TTL = float(os.environ.get("PRINCIPAL_CACHE_TTL", 60))
+
+# Ingest checks device ids against an in-process registry loaded at startup.
+# Other workers' new devices are picked up on a miss once the negative entry
+# expires, and by a periodic full refresh (0 disables it).
+DEVICE_REGISTRY_REFRESH_INTERVAL = float(
+    os.environ.get("DEVICE_REGISTRY_REFRESH_INTERVAL", 60)
+)
+DEVICE_REGISTRY_NEGATIVE_TTL = float(os.environ.get("DEVICE_REGISTRY_NEGATIVE_TTL", 5))
+DEVICE_REGISTRY_NEGATIVE_SIZE = int(
+    os.environ.get("DEVICE_REGISTRY_NEGATIVE_SIZE", 10000)
+)
+
+# Analysis results keyed by request parameters and the data version of the
+# devices involved, so new readings make old entries unreachable.
+ANALYSIS_CACHE_SIZE = int(os.environ.get("ANALYSIS_CACHE_SIZE", 10000))
+ANALYSIS_CACHE_TTL = float(os.environ.get("ANALYSIS_CACHE_TTL", 3600))
+
+# Rows fetched per round-trip by server-side cursors of streaming endpoints.
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", 1000))
+
+# Largest page of device ids /devices returns; bigger lists are streamed.
+DEVICES_PAGE_MAX_LIMIT = int(os.environ.get("DEVICES_PAGE_MAX_LIMIT", 10_000))
+
+# LTTB downsampling loads the raw readings of the range into memory, so it
+# refuses ranges with more readings than this.
+SERIES_LTTB_MAX_ROWS = int(os.environ.get("SERIES_LTTB_MAX_ROWS", 5_000_000))
+
+# Rolling statistics return at most this many windows per request.
+ROLLING_MAX_WINDOWS = int(os.environ.get("ROLLING_MAX_WINDOWS", 10_000))
+
+# Write-behind ingest: new_data queues readings and a background task writes
+# them in multi-row transactions.
+INGEST_WRITE_BEHIND = env_flag("INGEST_WRITE_BEHIND")
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", 10000))
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", 1000))
+INGEST_MAX_DELAY = float(os.environ.get("INGEST_MAX_DELAY", 0.05))
+INGEST_PUT_TIMEOUT = float(os.environ.get("INGEST_PUT_TIMEOUT", 1.0))
+
+# Approximate medians come from log-bucketed quantile sketches whose values
+# are within this relative error of the exact ones. Sketches already stored
+# are built with the old accuracy, so changing it requires a rebuild.
+SKETCH_RELATIVE_ACCURACY = float(os.environ.get("SKETCH_RELATIVE_ACCURACY", 0.01))
+
+# In-memory cache of the most recent readings per device. It only sees
+# readings ingested by this process, so it must stay disabled when several
+# workers or other writers (devices.seed, other instances) share the
+# database; serve.py refuses to start it with SERVER_WORKERS > 1.
+HOT_WINDOW_ENABLED = env_flag("HOT_WINDOW_ENABLED")
+HOT_WINDOW_SECONDS = float(os.environ.get("HOT_WINDOW_SECONDS", 3600))
+HOT_WINDOW_MAX_BYTES = int(os.environ.get("HOT_WINDOW_MAX_BYTES", 256 * 2**20))
+HOT_WINDOW_DEVICE_ROWS = int(os.environ.get("HOT_WINDOW_DEVICE_ROWS", 100000))
+
+# Database connection pool. SQL echo is off by default; DB_POOL_RECYCLE=-1
+# keeps connections forever. DB_POOL_PRE_PING adds a round trip to every
+# checkout, and the accessor checks out a connection per query, so it is
+# off unless connections are known to be dropped while idle. In PgBouncer mode (transaction pooling) asyncpg
+# prepared statements are not cached and get unique names, since consecutive
+# transactions may land on different server connections.
+DB_ECHO = env_flag("DB_ECHO")
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = env_flag("DB_POOL_PRE_PING")
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 100))
+DB_PGBOUNCER = env_flag("DB_PGBOUNCER")
+
+# Live push of new readings to WebSocket/SSE subscribers of this process.
+# A subscriber whose queue fills up first gets only the latest reading per
+# device, and is disconnected if that still does not fit.
+PUBSUB_QUEUE_SIZE = int(os.environ.get("PUBSUB_QUEUE_SIZE", 1000))
+PUBSUB_MAX_SUBSCRIBERS = int(os.environ.get("PUBSUB_MAX_SUBSCRIBERS", 10000))
+PUBSUB_HEARTBEAT = float(os.environ.get("PUBSUB_HEARTBEAT", 15))
+
+# The data table is range-partitioned by date into "day" or "month"
+# partitions. A maintenance task keeps DATA_PARTITION_PREMAKE partitions
+# ahead of the current one and removes partitions that ended more than
+# DATA_RETENTION_DAYS ago (0 keeps everything): "drop" deletes them, "detach"
+# leaves them as standalone tables. Changing the interval only affects
+# partitions created afterwards. Every partition is created, removed or
+# archived in a transaction of its own that gives up after waiting
+# DATA_PARTITION_LOCK_TIMEOUT seconds for a lock; the next round retries it.
+DATA_PARTITION_INTERVAL = os.environ.get("DATA_PARTITION_INTERVAL", "month")
+DATA_PARTITION_PREMAKE = int(os.environ.get("DATA_PARTITION_PREMAKE", 2))
+DATA_PARTITION_MAINTENANCE_INTERVAL = float(
+    os.environ.get("DATA_PARTITION_MAINTENANCE_INTERVAL", 3600)
+)
+DATA_PARTITION_LOCK_TIMEOUT = float(os.environ.get("DATA_PARTITION_LOCK_TIMEOUT", 5))
+DATA_RETENTION_DAYS = float(os.environ.get("DATA_RETENTION_DAYS", 0))
+DATA_RETENTION_MODE = os.environ.get("DATA_RETENTION_MODE", "drop")
+
+# Partitions that ended more than ARCHIVE_AFTER_DAYS ago (0 disables the
+# archive) are exported by the partition maintenance into per-device columnar
+# segment files under ARCHIVE_DIR and dropped from Postgres. Uncompressed
+# segments are memory-mapped by the analysis, compressed ones are smaller but
+# read into memory.
+ARCHIVE_AFTER_DAYS = float(os.environ.get("ARCHIVE_AFTER_DAYS", 0))
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "archive")
+ARCHIVE_COMPRESS = env_flag("ARCHIVE_COMPRESS")
+
+# Production launcher (serve.py). The schema is set up once by the launcher
+# before the workers start: "alembic" upgrades to head, "create_all" creates
+# missing tables from the models, "none" skips it. On shutdown readiness
+# turns false at once, the workers keep serving for SERVER_DRAIN_DELAY
+# seconds and then in-flight requests get SERVER_GRACEFUL_TIMEOUT seconds
+# to finish.
+SERVER_HOST = os.environ.get("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.environ.get("SERVER_PORT", 8000))
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", cpu_count()))
+SERVER_DRAIN_DELAY = float(os.environ.get("SERVER_DRAIN_DELAY", 0))
+SERVER_GRACEFUL_TIMEOUT = int(os.environ.get("SERVER_GRACEFUL_TIMEOUT", 30))
+DB_SCHEMA_SETUP = os.environ.get("DB_SCHEMA_SETUP", "alembic")
@@ -1,20 +1,165 @@
+import asyncio
+import math
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import AsyncIterator
 from hashlib import sha256
 
 import jwt
-from config import JWT_ALGORITHM, JWT_SECRET
+from config import (
+    ANALYSIS_CACHE_SIZE,
+    ANALYSIS_CACHE_TTL,
+    ARCHIVE_AFTER_DAYS,
+    ARCHIVE_COMPRESS,
+    ARCHIVE_DIR,
+    DATA_PARTITION_INTERVAL,
+    DATA_PARTITION_LOCK_TIMEOUT,
+    DATA_PARTITION_MAINTENANCE_INTERVAL,
+    DATA_PARTITION_PREMAKE,
+    DATA_RETENTION_DAYS,
+    DATA_RETENTION_MODE,
+    DEVICE_REGISTRY_NEGATIVE_SIZE,
+    DEVICE_REGISTRY_NEGATIVE_TTL,
+    DEVICE_REGISTRY_REFRESH_INTERVAL,
+    HOT_WINDOW_DEVICE_ROWS,
+    HOT_WINDOW_ENABLED,
+    HOT_WINDOW_MAX_BYTES,
+    HOT_WINDOW_SECONDS,
+    INGEST_BATCH_SIZE,
+    INGEST_MAX_DELAY,
+    INGEST_PUT_TIMEOUT,
+    INGEST_QUEUE_SIZE,
+    INGEST_WRITE_BEHIND,
+    JWT_ALGORITHM,
+    JWT_SECRET,
+    PRINCIPAL_CACHE_SIZE,
+    PRINCIPAL_CACHE_TTL,
+    PUBSUB_MAX_SUBSCRIBERS,
+    PUBSUB_QUEUE_SIZE,
+    ROLLING_MAX_WINDOWS,
+    SERIES_LTTB_MAX_ROWS,
+    SKETCH_RELATIVE_ACCURACY,
+    STREAM_CHUNK_SIZE,
+)
+from database.archive import ArchivedRange, ArchiveStore, merge_aggregates
 from database.base import async_session
-from database.dataclasses import Analysis, Data, Device, User
-from database.models import DataModel, DeviceModel, UserModel
+from database.cache import TTLCache
+from database.dataclasses import (
+    Analysis,
+    Data,
+    DataPeriod,
+    Device,
+    RollingWindow,
+    User,
+)
+from database.filters import device_filter, user_device_ids
+from database.hot_window import HotWindowCache
+from database.models import DataModel, DeviceModel, DevicePeriodModel, UserModel
+from database.partitions import PartitionMaintainer, utc_now
+from database.pubsub import PubSubHub
+from database.registry import DeviceRegistry
+from database.rollups import RollupAnalyst, rollups_upsert
+from database.rolling import RollingAnalyst
+from database.series import SeriesAnalyst
+from database.sketches import (
+    SketchAnalyst,
+    sketch_quantile,
+    sketch_rows,
+    sketch_upsert,
+)
+from database.write_behind import WriteBehindBuffer
 from devices.device_simulator import SomeDevice
-from sqlalchemy import func, insert, select
+from metrics import label_queries
+from sqlalchemy import Row, Select, case, func, insert, select
 from sqlalchemy.dialects.postgresql import insert as insert_psql
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 
+ANALYSIS_COLUMNS = {"x": DataModel.x, "y": DataModel.y, "z": DataModel.z}
 
+
+def analysis_columns(column: str = None) -> list[str]:
+    # A known column alone, anything else means all of them.
+    if column in ANALYSIS_COLUMNS:
+        return [column]
+    return list(ANALYSIS_COLUMNS)
+
+
+@label_queries
 class BaseAccessor:
     def __init__(self) -> None:
         self.session = async_session
+        self.ready = False
+        self.principals = TTLCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL)
+        self.analysis_cache = TTLCache(ANALYSIS_CACHE_SIZE, ANALYSIS_CACHE_TTL)
+        self.registry = DeviceRegistry(
+            self.session,
+            refresh_interval=DEVICE_REGISTRY_REFRESH_INTERVAL,
+            negative_ttl=DEVICE_REGISTRY_NEGATIVE_TTL,
+            negative_size=DEVICE_REGISTRY_NEGATIVE_SIZE,
+        )
+        self.archive = None
+        if ARCHIVE_AFTER_DAYS:
+            self.archive = ArchiveStore(
+                self.session,
+                directory=ARCHIVE_DIR,
+                archive_after=timedelta(days=ARCHIVE_AFTER_DAYS),
+                interval=DATA_PARTITION_INTERVAL,
+                compress=ARCHIVE_COMPRESS,
+            )
+        self.partitions = PartitionMaintainer(
+            self.session,
+            interval=DATA_PARTITION_INTERVAL,
+            premake=DATA_PARTITION_PREMAKE,
+            retention=timedelta(days=DATA_RETENTION_DAYS),
+            retention_mode=DATA_RETENTION_MODE,
+            maintenance_interval=DATA_PARTITION_MAINTENANCE_INTERVAL,
+            lock_timeout=DATA_PARTITION_LOCK_TIMEOUT,
+            archive=self.archive,
+        )
+        self.hot_window = None
+        if HOT_WINDOW_ENABLED:
+            self.hot_window = HotWindowCache(
+                window=HOT_WINDOW_SECONDS,
+                max_bytes=HOT_WINDOW_MAX_BYTES,
+                device_rows=HOT_WINDOW_DEVICE_ROWS,
+            )
+        self.pubsub = PubSubHub(PUBSUB_QUEUE_SIZE, PUBSUB_MAX_SUBSCRIBERS)
+        self.write_behind = None
+        if INGEST_WRITE_BEHIND:
+            self.write_behind = WriteBehindBuffer(
+                self.new_data_batch,
+                max_size=INGEST_QUEUE_SIZE,
+                batch_size=INGEST_BATCH_SIZE,
+                max_delay=INGEST_MAX_DELAY,
+                put_timeout=INGEST_PUT_TIMEOUT,
+            )
+
+    async def start(self) -> None:
+        await self.registry.refresh()
+        self.registry.start()
+        self.partitions.start()
+        if self.hot_window:
+            self.hot_window.start()
+        if self.write_behind:
+            self.write_behind.start()
+        self.ready = True
+
+    async def stop(self) -> None:
+        self.ready = False
+        self.pubsub.close()
+        if self.write_behind:
+            await self.write_behind.stop()
+        await self.registry.stop()
+        await self.partitions.stop()
+
+    async def ping(self) -> bool:
+        try:
+            async with self.session() as session:
+                await session.execute(select(1))
+        except (OSError, SQLAlchemyError):
+            return False
+        return True
 
     async def add_user(self, login: str, password_str: str) -> User:
         password = sha256(password_str.encode("utf-8")).hexdigest()
@@ -34,7 +179,9 @@ class BaseAccessor:
             )
         return user
 
-    async def get_user(self, id: int = None, login: str = None) -> User:
+    async def get_user(
+        self, id: int = None, login: str = None, with_devices: bool = True
+    ) -> User:
         stmt = select(UserModel)
         if id:
             stmt = stmt.where(UserModel.id == id)
@@ -49,12 +196,12 @@ class BaseAccessor:
             user = User(
                 id=user_obj.id, login=user_obj.login, password=user_obj.password
             )
-        devices = await self.get_devices(id)
-        user.devices = devices
+        if with_devices:
+            user.devices = await self.get_devices(user.id)
         return user
 
     async def auth_user(self, login: str, password_str: str) -> str:
-        user = await self.get_user(login=login)
+        user = await self.get_user(login=login, with_devices=False)
         if not user:
             return None
         password = sha256(password_str.encode("utf-8")).hexdigest()
@@ -65,13 +212,18 @@ class BaseAccessor:
         return token
 
     async def get_user_by_token(self, token: str) -> User:
+        user = self.principals.get(token)
+        if user:
+            return user
         try:
             decoded_token = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
         except:
             return None
         if decoded_token["expires"] < time.time():
             return None
-        user = await self.get_user(id=decoded_token["user_id"])
+        user = await self.get_user(id=decoded_token["user_id"], with_devices=False)
+        if user:
+            self.principals.set(token, user, expires_at=decoded_token["expires"])
         return user
 
     async def add_device(self, id: int, user_id: int) -> Device:
@@ -87,14 +239,14 @@ class BaseAccessor:
             if not device_obj:
                 return None
             device = Device(id=device_obj.id)
+        self.registry.add(device.id, user_id)
+        self.principals.invalidate(lambda token, user: user.id == user_id)
         return device
 
     async def get_devices(self, user_id: int = None) -> list[Device]:
         stmt = select(DeviceModel)
         if user_id:
-            stmt = stmt.join(UserModel, UserModel.id == DeviceModel.user_id).where(
-                UserModel.id == user_id
-            )
+            stmt = stmt.where(DeviceModel.user_id == user_id)
         async with self.session() as session:
             device_objs = await session.scalars(stmt)
             devices = []
@@ -104,6 +256,31 @@ class BaseAccessor:
                 devices.append(Device(id=device_obj.id))
         return devices
 
+    async def get_device_ids(
+        self, after_id: int = None, limit: int = None
+    ) -> list[int]:
+        stmt = select(DeviceModel.id).order_by(DeviceModel.id)
+        if after_id is not None:
+            stmt = stmt.where(DeviceModel.id > after_id)
+        if limit:
+            stmt = stmt.limit(limit)
+        async with self.session() as session:
+            device_ids = list(await session.scalars(stmt))
+        return device_ids
+
+    async def stream_device_ids(
+        self, chunk_size: int = STREAM_CHUNK_SIZE
+    ) -> AsyncIterator[list[int]]:
+        stmt = (
+            select(DeviceModel.id)
+            .order_by(DeviceModel.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        async with self.session() as session:
+            result = await session.stream_scalars(stmt)
+            async for device_ids in result.partitions():
+                yield device_ids
+
     async def get_device(self, id: int) -> Device:
         stmt = select(DeviceModel).where(DeviceModel.id == id)
         async with self.session() as session:
@@ -113,25 +290,113 @@ class BaseAccessor:
             device = Device(id=device_obj.id)
         return device
 
+    async def device_exists(self, id: int) -> bool:
+        return await self.registry.exists(id)
+
     async def new_data(self, device_id: int) -> Data:
         x, y, z = SomeDevice.get_data()
-        stmt = (
-            insert(DataModel)
-            .values(x=x, y=y, z=z, device_id=device_id)
-            .returning(DataModel)
-        )
+        # Both write paths date readings on the app side in UTC, so that the
+        # dates do not depend on the database's time zone.
+        data = Data(x=x, y=y, z=z, date=utc_now())
+        if self.write_behind:
+            if not await self.write_behind.put(device_id, data):
+                return None
+            return data
 
+        stmt = insert(DataModel).values(
+            x=x, y=y, z=z, date=data.date, device_id=device_id
+        )
+        # Like the batch path, the period is locked before the readings, in
+        # the order the partition maintenance takes its locks.
         async with self.session() as session:
-            data_obj = await session.scalar(stmt)
+            await self.track_new_data(session, {device_id: [data]})
+            await session.execute(stmt)
             await session.commit()
-            data = Data(
-                x=x,
-                y=y,
-                z=z,
-                date=data_obj.date,
-            )
+        self.after_new_data({device_id: [data]})
         return data
 
+    async def new_data_batch(
+        self, new_data: dict[int, list[Data]]
+    ) -> tuple[dict[int, int], list[int]]:
+        known_ids = await self.registry.known(*new_data)
+        known_data = {
+            device_id: data
+            for device_id, data in new_data.items()
+            if device_id in known_ids
+        }
+        if known_data:
+            async with self.session() as session:
+                await self.track_new_data(session, known_data)
+                await self.copy_data(session, known_data)
+                await session.commit()
+            self.after_new_data(known_data)
+        counts = {device_id: len(data) for device_id, data in known_data.items()}
+        unknown_ids = [
+            device_id for device_id in new_data if device_id not in known_ids
+        ]
+        return counts, unknown_ids
+
+    async def copy_data(
+        self, session: AsyncSession, new_data: dict[int, list[Data]]
+    ) -> None:
+        # asyncpg binary COPY on the session's own connection. The session
+        # must already have executed a statement: only then has it opened
+        # the transaction that the COPY joins.
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        records = [
+            (device_id, d.x, d.y, d.z, d.date)
+            for device_id, data in new_data.items()
+            for d in data
+        ]
+        await raw_connection.driver_connection.copy_records_to_table(
+            DataModel.__tablename__,
+            records=records,
+            columns=["device_id", "x", "y", "z", "date"],
+        )
+
+    async def track_new_data(
+        self, session: AsyncSession, new_data: dict[int, list[Data]]
+    ) -> None:
+        periods = []
+        for device_id in sorted(new_data):
+            dates = [d.date for d in new_data[device_id]]
+            periods.append(
+                {
+                    "device_id": device_id,
+                    "first_date": min(dates),
+                    "last_date": max(dates),
+                    "count": len(dates),
+                }
+            )
+        stmt = insert_psql(DevicePeriodModel)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["device_id"],
+            set_={
+                "first_date": func.least(
+                    DevicePeriodModel.first_date, stmt.excluded.first_date
+                ),
+                "last_date": func.greatest(
+                    DevicePeriodModel.last_date, stmt.excluded.last_date
+                ),
+                "count": DevicePeriodModel.count + stmt.excluded.count,
+                "backfills": DevicePeriodModel.backfills
+                + case(
+                    (stmt.excluded.first_date <= DevicePeriodModel.last_date, 1),
+                    else_=0,
+                ),
+            },
+        )
+        await session.execute(stmt, periods)
+
+        await session.execute(rollups_upsert(new_data))
+        await session.execute(sketch_upsert(), sketch_rows(new_data))
+
+    def after_new_data(self, new_data: dict[int, list[Data]]) -> None:
+        if self.hot_window:
+            self.hot_window.add(new_data)
+        self.pubsub.publish(new_data, self.registry.devices)
+
     async def get_all_data(self) -> list[Data]:
         stmt = select(DataModel)
         async with self.session() as session:
@@ -152,10 +417,7 @@ class BaseAccessor:
 
     async def get_device_data(self, id: int) -> list[Data]:
         stmt = (
-            select(DataModel)
-            .join(DeviceModel, DeviceModel.id == DataModel.device_id)
-            .where(DeviceModel.id == id)
-            .order_by(DataModel.date)
+            select(DataModel).where(DataModel.device_id == id).order_by(DataModel.date)
         )
         async with self.session() as session:
             data_objs = await session.scalars(stmt)
@@ -176,9 +438,7 @@ class BaseAccessor:
     async def get_user_data(self, id: int) -> list[Data]:
         stmt = (
             select(DataModel)
-            .join(DeviceModel, DeviceModel.id == DataModel.device_id)
-            .join(UserModel, UserModel.id == DeviceModel.id)
-            .where(UserModel.id == id)
+            .where(DataModel.device_id.in_(user_device_ids(id)))
             .order_by(DataModel.date)
         )
         async with self.session() as session:
@@ -197,23 +457,107 @@ class BaseAccessor:
                 )
         return data
 
+    async def check_archive(
+        self,
+        begin: datetime = None,
+        end: datetime = None,
+        device_id: int = None,
+        user_id: int = None,
+        lookback: timedelta = timedelta(),
+    ) -> None:
+        # Requests that only read the data table refuse ranges with archived
+        # readings instead of returning them incomplete. Requests that also
+        # read lookback before begin can start that much after the archive.
+        if not self.archive:
+            return
+        until = await self.archive.archived_until(
+            begin - lookback if begin else None, end, device_id, user_id
+        )
+        if until:
+            raise ArchivedRange(until + lookback)
+
+    async def stream_data(
+        self,
+        device_id: int = None,
+        user_id: int = None,
+        begin: datetime = None,
+        end: datetime = None,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+    ) -> AsyncIterator[list[Data]]:
+        stmt = (
+            select(
+                DataModel.device_id,
+                DataModel.x,
+                DataModel.y,
+                DataModel.z,
+                DataModel.date,
+            )
+            .where(device_filter(DataModel.device_id, device_id, user_id))
+            .order_by(DataModel.device_id, DataModel.date)
+            .execution_options(yield_per=chunk_size)
+        )
+        if begin:
+            stmt = stmt.where(DataModel.date >= begin)
+        if end:
+            stmt = stmt.where(DataModel.date <= end)
+        async with self.session() as session:
+            result = await session.stream(stmt)
+            async for rows in result.partitions():
+                yield [
+                    Data(x=x, y=y, z=z, date=date, device_id=row_device_id)
+                    for row_device_id, x, y, z, date in rows
+                ]
+
     async def get_total_period(self) -> list[datetime]:
-        data = await self.get_all_data()
-        if not data:
+        period = await self.get_data_period()
+        if not period:
             return None
-        return [data[0].date, data[-1].date]
+        return [period.first_date, period.last_date]
 
     async def get_device_period(self, id: int) -> list[datetime]:
-        device_data = await self.get_device_data(id)
-        if not device_data:
+        period = await self.get_data_period(device_id=id)
+        if not period:
             return None
-        return [device_data[0].date, device_data[-1].date]
+        return [period.first_date, period.last_date]
 
     async def get_user_period(self, id: int) -> list[datetime]:
-        user_data = await self.get_user_data(id)
-        if not user_data:
+        period = await self.get_data_period(user_id=id)
+        if not period:
+            return None
+        return [period.first_date, period.last_date]
+
+    async def get_data_period(
+        self, device_id: int = None, user_id: int = None
+    ) -> DataPeriod:
+        if device_id:
+            stmt = select(
+                DevicePeriodModel.first_date,
+                DevicePeriodModel.last_date,
+                DevicePeriodModel.count,
+                DevicePeriodModel.backfills,
+            ).where(DevicePeriodModel.device_id == device_id)
+        else:
+            stmt = select(
+                func.min(DevicePeriodModel.first_date),
+                func.max(DevicePeriodModel.last_date),
+                func.sum(DevicePeriodModel.count),
+                func.sum(DevicePeriodModel.backfills),
+            )
+            if user_id:
+                stmt = stmt.where(
+                    DevicePeriodModel.device_id.in_(user_device_ids(user_id))
+                )
+        async with self.session() as session:
+            result = await session.execute(stmt)
+            period = result.first()
+        if not period or period[0] is None:
             return None
-        return [user_data[0].date, user_data[-1].date]
+        return DataPeriod(
+            first_date=period[0],
+            last_date=period[1],
+            count=period[2],
+            backfills=period[3],
+        )
 
     async def get_analysis(
         self,
@@ -222,41 +566,283 @@ class BaseAccessor:
         column: str = None,
         begin: datetime = datetime(1753, 1, 1, 0, 0, 0),
         end: datetime = datetime(9999, 12, 31, 23, 59, 59),
+        approx: bool = False,
     ) -> list[Analysis]:
         if device_id:
-            period = await self.get_device_period(device_id)
+            period = await self.get_data_period(device_id=device_id)
         elif user_id:
-            period = await self.get_user_period(user_id)
+            period = await self.get_data_period(user_id=user_id)
         else:
-            period = await self.get_total_period()
+            period = await self.get_data_period()
 
         if not period:
             return None
 
-        if begin < period[0]:
-            begin_date = period[0]
+        if begin < period.first_date:
+            begin_date = period.first_date
         else:
             begin_date = begin
 
-        if end > period[1]:
-            end_date = period[1]
+        if end > period.last_date:
+            end_date = period.last_date
         else:
             end_date = end
 
-        if column in {"x", "y", "z"}:
-            analysis = await self.column_analysis(
-                column, begin_date, end_date, device_id, user_id
+        # New readings of a device are dated after its last one, so a range
+        # of one device that ends before that can only change by a backfill.
+        if device_id and end <= period.last_date:
+            version = (period.backfills,)
+        else:
+            version = (period.backfills, period.count)
+        cache_key = (device_id, user_id, column, begin, end, approx, version)
+        analysis = self.analysis_cache.get(cache_key)
+        if analysis:
+            return analysis
+
+        analysis = await self.compute_analysis(
+            device_id, user_id, column, begin_date, end_date, approx
+        )
+        self.analysis_cache.set(cache_key, analysis)
+        return analysis
+
+    async def get_devices_analysis(
+        self,
+        device_ids: list[int] = None,
+        user_id: int = None,
+        column: str = None,
+        begin: datetime = datetime(1753, 1, 1, 0, 0, 0),
+        end: datetime = datetime(9999, 12, 31, 23, 59, 59),
+    ) -> dict[int, list[Analysis]]:
+        stmt = select(
+            DevicePeriodModel.device_id,
+            DevicePeriodModel.first_date,
+            DevicePeriodModel.last_date,
+        )
+        if device_ids:
+            stmt = stmt.where(DevicePeriodModel.device_id.in_(device_ids))
+        elif user_id:
+            stmt = stmt.where(DevicePeriodModel.device_id.in_(user_device_ids(user_id)))
+        async with self.session() as session:
+            result = await session.execute(stmt)
+            periods = {device_id: (first, last) for device_id, first, last in result}
+        if not periods:
+            return None
+        archived = set()
+        if self.archive:
+            archived = await self.archive.archived_devices(begin, end, list(periods))
+
+        columns = analysis_columns(column)
+
+        # One grouped scan for the devices whose readings of the range are all
+        # in the table; the per-device periods only clamp the reported dates,
+        # rows outside them do not exist anyway. Devices with archived
+        # readings are analysed one by one, archive included.
+        analyst = Data_Analyst(columns, begin, end)
+        rows = {}
+        if len(archived) < len(periods):
+            rows = await analyst.analysis_by_device(
+                [device_id for device_id in periods if device_id not in archived]
+            )
+        archived_analysis = await asyncio.gather(
+            *(
+                self.compute_analysis(
+                    device_id,
+                    None,
+                    column,
+                    max(begin, periods[device_id][0]),
+                    min(end, periods[device_id][1]),
+                    False,
+                )
+                for device_id in sorted(archived)
+            )
+        )
+        analysis = dict(zip(sorted(archived), archived_analysis))
+        empty_row = [None, None, 0, None, None] * len(columns)
+        for device_id, (first_date, last_date) in sorted(periods.items()):
+            if device_id in archived:
+                continue
+            analysis[device_id] = analyst.row_analysis(
+                rows.get(device_id, empty_row),
+                max(begin, first_date),
+                min(end, last_date),
+            )
+        return dict(sorted(analysis.items()))
+
+    async def compute_analysis(
+        self,
+        device_id: int,
+        user_id: int,
+        column: str,
+        begin_date: datetime,
+        end_date: datetime,
+        approx: bool,
+    ) -> list[Analysis]:
+        columns = analysis_columns(column)
+
+        if self.hot_window and not user_id:
+            analysis = self.hot_window.analysis(
+                columns, begin_date, end_date, device_id
+            )
+            if analysis:
+                return analysis
+
+        if self.archive and begin_date < self.archive.horizon():
+            analysis = await self.archive_analysis(
+                columns, begin_date, end_date, device_id, user_id, approx
+            )
+            if analysis:
+                return analysis
+
+        analysis = await self.columns_analysis(
+            columns, begin_date, end_date, device_id, user_id, approx
+        )
+        return analysis
+
+    async def archive_analysis(
+        self,
+        columns: list[str],
+        begin_date: datetime,
+        end_date: datetime,
+        device_id: int = None,
+        user_id: int = None,
+        approx: bool = False,
+    ) -> list[Analysis]:
+        scan = await self.archive.scan(
+            columns, begin_date, end_date, device_id, user_id
+        )
+        if not scan:
+            return None
+        live_begin = max(begin_date, scan.until)
+
+        # The archived part comes from the segments, the rest of the range from
+        # rollups and sketches as usual. Medians need the sketch bins of both.
+        aggregates = {column: (None, None, 0, None) for column in columns}
+        bins = {column: [] for column in columns}
+        if live_begin <= end_date:
+            rollup_analyst = RollupAnalyst(
+                columns, live_begin, end_date, device_id, user_id
+            )
+            sketch_analyst = SketchAnalyst(
+                columns, live_begin, end_date, device_id, user_id
+            )
+            aggregates, bins = await asyncio.gather(
+                rollup_analyst.aggregates(), sketch_analyst.bins()
+            )
+        median_error = None
+        if approx:
+            medians = {
+                column: sketch_quantile(bins[column] + scan.bins[column], 0.5)
+                for column in columns
+            }
+            median_error = SKETCH_RELATIVE_ACCURACY
+        else:
+            medians = await self.archive.medians(
+                scan, bins, live_begin, end_date, device_id, user_id
             )
-            return [analysis]
 
         analysis = []
-        for column in {"x", "y", "z"}:
-            column_analysis = await self.column_analysis(
-                column, begin_date, end_date, device_id, user_id
+        for column in columns:
+            min_value, max_value, count, sum = merge_aggregates(
+                scan.aggregates[column], aggregates[column]
+            )
+            analysis.append(
+                Analysis(
+                    column=column,
+                    begin_date=begin_date,
+                    end_date=end_date,
+                    min_value=min_value,
+                    max_value=max_value,
+                    count=count,
+                    sum=sum,
+                    median=medians[column],
+                    median_error=median_error,
+                )
             )
-            analysis.append(column_analysis)
         return analysis
 
+    async def get_series(
+        self,
+        device_id: int,
+        column: str = None,
+        begin: datetime = datetime(1753, 1, 1, 0, 0, 0),
+        end: datetime = datetime(9999, 12, 31, 23, 59, 59),
+        points: int = 500,
+        method: str = "bucket",
+    ) -> dict[str, list[tuple[datetime, float]]]:
+        period = await self.get_device_period(device_id)
+        if not period:
+            return None
+        begin_date = max(begin, period[0])
+        end_date = min(end, period[1])
+        await self.check_archive(begin_date, end_date, device_id=device_id)
+
+        columns = analysis_columns(column)
+
+        analyst = SeriesAnalyst(device_id, columns, begin_date, end_date, points)
+        if method == "lttb":
+            return await analyst.lttb(SERIES_LTTB_MAX_ROWS, STREAM_CHUNK_SIZE)
+        return await analyst.buckets()
+
+    async def get_rolling(
+        self,
+        device_id: int = None,
+        user_id: int = None,
+        column: str = None,
+        begin: datetime = datetime(1753, 1, 1, 0, 0, 0),
+        end: datetime = datetime(9999, 12, 31, 23, 59, 59),
+        window: float = 60,
+        step: float = None,
+        unit: str = "seconds",
+    ) -> dict[str, list[RollingWindow]]:
+        period = await self.get_data_period(device_id=device_id, user_id=user_id)
+        if not period:
+            return None
+        begin_date = max(begin, period.first_date)
+        end_date = min(end, period.last_date)
+        # Windows in seconds also read the readings just before begin.
+        lookback = timedelta(seconds=window) if unit == "seconds" else timedelta()
+        await self.check_archive(
+            begin_date, end_date, device_id, user_id, lookback=lookback
+        )
+
+        columns = analysis_columns(column)
+
+        if not step and period.count > ROLLING_MAX_WINDOWS:
+            step = await self.rolling_step(
+                begin_date, end_date, window, unit, device_id, user_id
+            )
+        analyst = RollingAnalyst(
+            columns, begin_date, end_date, window, step, unit, device_id, user_id
+        )
+        return await analyst.windows(ROLLING_MAX_WINDOWS)
+
+    async def rolling_step(
+        self,
+        begin_date: datetime,
+        end_date: datetime,
+        window: float,
+        unit: str,
+        device_id: int = None,
+        user_id: int = None,
+    ) -> float:
+        # Without a step every reading ends a window. A range with more
+        # readings than ROLLING_MAX_WINDOWS gets the smallest step that keeps
+        # the windows within it; the rollups count the readings.
+        if begin_date >= end_date:
+            return None
+        analyst = RollupAnalyst(["x"], begin_date, end_date, device_id, user_id)
+        aggregates = await analyst.aggregates()
+        count = aggregates["x"][2] or 0
+        if count <= ROLLING_MAX_WINDOWS:
+            return None
+        if unit == "rows":
+            # Windows end at readings size, size + step, ... up to count.
+            size = max(int(window), 1)
+            return math.ceil((count - size + 1) / ROLLING_MAX_WINDOWS)
+        # A window per step seconds since begin, the last one at end_date.
+        seconds = (end_date - begin_date).total_seconds()
+        return seconds / (ROLLING_MAX_WINDOWS - 1)
+
     async def column_analysis(
         self,
         column: str,
@@ -264,111 +850,145 @@ class BaseAccessor:
         end_date: datetime,
         device_id: int = None,
         user_id: int = None,
+        approx: bool = False,
     ) -> Analysis:
-        analyst = Data_Analyst(column, begin_date, end_date, device_id, user_id)
-        min_value = await analyst.min_value()
-        max_value = await analyst.max_value()
-        count = await analyst.count()
-        sum = await analyst.sum()
-        median = await analyst.median()
-
-        return Analysis(
-            column=column,
-            begin_date=begin_date,
-            end_date=end_date,
-            min_value=min_value,
-            max_value=max_value,
-            count=count,
-            sum=sum,
-            median=median,
+        analysis = await self.columns_analysis(
+            [column], begin_date, end_date, device_id, user_id, approx
+        )
+        return analysis[0]
+
+    async def columns_analysis(
+        self,
+        columns: list[str],
+        begin_date: datetime,
+        end_date: datetime,
+        device_id: int = None,
+        user_id: int = None,
+        approx: bool = False,
+    ) -> list[Analysis]:
+        analyst = Data_Analyst(columns, begin_date, end_date, device_id, user_id)
+        rollup_analyst = RollupAnalyst(
+            columns, begin_date, end_date, device_id, user_id
         )
+        if not rollup_analyst.buckets:
+            analysis = await analyst.analysis()
+            return analysis
+
+        # Whole buckets answer min/max/count/sum. An exact median still needs
+        # the raw rows, an approximate one merges the stored sketches; either
+        # way the median query runs side by side with the rollup one.
+        median_error = None
+        if approx:
+            median_analyst = SketchAnalyst(
+                columns, begin_date, end_date, device_id, user_id
+            )
+            median_error = SKETCH_RELATIVE_ACCURACY
+        else:
+            median_analyst = analyst
+        aggregates, medians = await asyncio.gather(
+            rollup_analyst.aggregates(), median_analyst.medians()
+        )
+        analysis = []
+        for column in columns:
+            min_value, max_value, count, sum = aggregates[column]
+            analysis.append(
+                Analysis(
+                    column=column,
+                    begin_date=begin_date,
+                    end_date=end_date,
+                    min_value=min_value,
+                    max_value=max_value,
+                    count=count,
+                    sum=sum,
+                    median=medians[column],
+                    median_error=median_error,
+                )
+            )
+        return analysis
 
 
 class Data_Analyst:
     def __init__(
         self,
-        column_name: str,
+        columns: list[str],
         begin: datetime,
         end: datetime,
         device_id: int = None,
         user_id: int = None,
     ) -> None:
         self.session = async_session
-        if device_id:
-            self.device_id = device_id
-            self.operation = self.operation_for_one_device
-        elif user_id:
-            self.user_id = user_id
-            self.operation = self.operation_for_user_devices
-        else:
-            self.operation = self.operation_for_all
+        self.device_id = device_id
+        self.user_id = user_id
         self.begin_date = begin
         self.end_date = end
-        match column_name:
-            case "x":
-                self.column = DataModel.x
-            case "y":
-                self.column = DataModel.y
-            case "z":
-                self.column = DataModel.z
-
-    async def operation_for_one_device(self, select_arg: callable) -> float:
-        stmt = (
-            select(select_arg(self.column))
-            .join(DeviceModel, DeviceModel.id == DataModel.device_id)
-            .where(
-                (DeviceModel.id == self.device_id)
-                & (DataModel.date >= self.begin_date)
-                & (DataModel.date <= self.end_date)
-            )
+        self.column_names = columns
+        self.columns = [ANALYSIS_COLUMNS[column] for column in columns]
+
+    def statement(self, select_args: list) -> Select:
+        return select(*select_args).where(
+            device_filter(DataModel.device_id, self.device_id, self.user_id)
+            & (DataModel.date >= self.begin_date)
+            & (DataModel.date <= self.end_date)
         )
+
+    async def operation(self, select_args: list) -> Row:
         async with self.session() as session:
-            result = await session.scalar(stmt)
-        return result
+            result = await session.execute(self.statement(select_args))
+            return result.one()
+
+    def select_args(self) -> list:
+        select_args = []
+        for column in self.columns:
+            select_args += [
+                func.min(column),
+                func.max(column),
+                func.count(column),
+                func.sum(column),
+                func.percentile_cont(0.5).within_group(column),
+            ]
+        return select_args
+
+    def row_analysis(
+        self, row: Row, begin_date: datetime, end_date: datetime
+    ) -> list[Analysis]:
+        analysis = []
+        for i, column_name in enumerate(self.column_names):
+            min_value, max_value, count, sum, median = row[i * 5 : (i + 1) * 5]
+            analysis.append(
+                Analysis(
+                    column=column_name,
+                    begin_date=begin_date,
+                    end_date=end_date,
+                    min_value=min_value,
+                    max_value=max_value,
+                    count=count,
+                    sum=sum,
+                    median=median,
+                )
+            )
+        return analysis
+
+    async def analysis(self) -> list[Analysis]:
+        row = await self.operation(self.select_args())
+        return self.row_analysis(row, self.begin_date, self.end_date)
 
-    async def operation_for_user_devices(self, select_arg: callable) -> float:
+    async def analysis_by_device(self, device_ids: list[int]) -> dict[int, Row]:
         stmt = (
-            select(select_arg(self.column))
-            .join(DeviceModel, DeviceModel.id == DataModel.device_id)
-            .join(UserModel, UserModel.id == DeviceModel.user_id)
+            select(DataModel.device_id, *self.select_args())
             .where(
-                (UserModel.id == self.user_id)
+                DataModel.device_id.in_(device_ids)
                 & (DataModel.date >= self.begin_date)
                 & (DataModel.date <= self.end_date)
             )
+            .group_by(DataModel.device_id)
         )
         async with self.session() as session:
-            result = await session.scalar(stmt)
-        return result
-
-    async def operation_for_all(self, select_arg: callable) -> float:
-        stmt = (
-            select(select_arg(self.column))
-            .join(DeviceModel, DeviceModel.id == DataModel.device_id)
-            .where(
-                (DataModel.date >= self.begin_date) & (DataModel.date <= self.end_date)
-            )
-        )
-        async with self.session() as session:
-            result = await session.scalar(stmt)
-        return result
-
-    async def min_value(self) -> float:
-        min = await self.operation(func.min)
-        return min
-
-    async def max_value(self) -> float:
-        max = await self.operation(func.max)
-        return max
-
-    async def count(self) -> int:
-        count = await self.operation(func.count)
-        return count
-
-    async def sum(self) -> float:
-        sum = await self.operation(func.sum)
-        return sum
-
-    async def median(self) -> float:
-        median = await self.operation(func.percentile_cont(0.5).within_group)
-        return median
+            result = await session.execute(stmt)
+            return {row[0]: row[1:] for row in result}
+
+    async def medians(self) -> dict[str, float]:
+        select_args = [
+            func.percentile_cont(0.5).within_group(column) for column in self.columns
+        ]
+        row = await self.operation(select_args)
+        return dict(zip(self.column_names, row))
@@ -0,0 +1,518 @@
+import asyncio
+import logging
+import math
+import os
+import shutil
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+from config import STREAM_CHUNK_SIZE
+from database.filters import device_filter
+from database.models import ArchiveSegmentModel, ArchiveSketchModel, DataModel
+from database.partitions import partition_start, utc_now
+from database.rollups import COLUMNS
+from database.sketches import bin_bounds, sketch_bin_counts
+from metrics import label_queries
+from sqlalchemy import delete, func, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+logger = logging.getLogger(__name__)
+
+# A segment holds the readings of one device from one exported partition as
+# a column per file: datetime64[us] dates in order, then float64 x, y, z.
+
+
+def segment_path(
+    name: str, device_id: int, first_date: datetime, compress: bool
+) -> str:
+    path = f"{name}/{device_id}-{first_date:%Y%m%dT%H%M%S%f}"
+    return path + ".npz" if compress else path
+
+
+def write_segment(
+    directory: str, path: str, arrays: dict[str, np.ndarray], compress: bool
+) -> None:
+    # Written next to the target and renamed, so a segment file is never seen
+    # half-written.
+    target = os.path.join(directory, path)
+    temporary = target + ".tmp"
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if compress:
+        with open(temporary, "wb") as file:
+            np.savez_compressed(file, **arrays)
+        os.replace(temporary, target)
+        return
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    for name, array in arrays.items():
+        np.save(os.path.join(temporary, f"{name}.npy"), array)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(temporary, target)
+
+
+def read_segment_array(directory: str, path: str, name: str) -> np.ndarray:
+    target = os.path.join(directory, path)
+    if path.endswith(".npz"):
+        with np.load(target) as arrays:
+            return arrays[name]
+    return np.load(os.path.join(target, f"{name}.npy"), mmap_mode="r")
+
+
+def remove_segment(directory: str, path: str) -> None:
+    target = os.path.join(directory, path)
+    if path.endswith(".npz"):
+        if os.path.exists(target):
+            os.remove(target)
+    else:
+        shutil.rmtree(target, ignore_errors=True)
+
+
+def merge_aggregates(*parts: tuple) -> tuple:
+    # (min, max, count, sum) of disjoint sets of readings.
+    parts = [part for part in parts if part[2]]
+    if not parts:
+        return None, None, 0, None
+    return (
+        min(part[0] for part in parts),
+        max(part[1] for part in parts),
+        sum(part[2] for part in parts),
+        sum(part[3] for part in parts),
+    )
+
+
+def band_limits(bins: list[tuple[int, int, int]], margin: int) -> tuple[float, float]:
+    """Value band around the median of the readings the sketch bins describe:
+    the bins holding the middle ranks and margin more bins on either side.
+    Without enough bins the band is open on that side."""
+    merged = defaultdict(int)
+    for sign, bin, count in bins:
+        merged[(sign, bin)] += count
+    ordered = sorted(merged, key=lambda key: (key[0], key[1] * key[0]))
+    total = sum(merged.values())
+    if not total:
+        return -math.inf, math.inf
+    ranks = [(total - 1) // 2, total // 2]
+    positions = []
+    seen = 0
+    for position, key in enumerate(ordered):
+        seen += merged[key]
+        while ranks and seen > ranks[0]:
+            ranks.pop(0)
+            positions.append(position)
+    low = positions[0] - margin
+    high = positions[-1] + margin
+    return (
+        bin_bounds(*ordered[low])[0] if low >= 0 else -math.inf,
+        bin_bounds(*ordered[high])[1] if high < len(ordered) else math.inf,
+    )
+
+
+class ArchivedRange(Exception):
+    # Raised by requests that read the data table only, for a range with
+    # archived readings; readings from until on are still in the table.
+    def __init__(self, until: datetime) -> None:
+        super().__init__(until)
+        self.until = until
+
+
+class ArchiveScan:
+    """Archived readings of a range, without their values in memory. Whole
+    segments are described by their index rows and stored sketches; of the
+    segments the range cuts, only the slice within it is read once, for its
+    summary and sketch bins. Values are read again, a segment at a time, only
+    where band() needs them."""
+
+    def __init__(
+        self,
+        directory: str,
+        segments: list[ArchiveSegmentModel],
+        bins: dict[str, list[tuple[int, int, int]]],
+        columns: list[str],
+        begin: datetime,
+        end: datetime,
+        until: datetime,
+    ) -> None:
+        # Readings dated before until are only in the archive.
+        self.until = until
+        self.directory = directory
+        self.columns = columns
+        # Sketch bins of all the archived readings of the range.
+        self.bins = {column: list(bins.get(column, [])) for column in columns}
+        # (path, start, stop, count, {column: (min, max)}) of every segment
+        # with readings in the range; start and stop are None for whole ones.
+        self.parts = []
+        np_begin = np.datetime64(begin, "us")
+        np_end = np.datetime64(end, "us")
+        summaries = {column: [] for column in columns}
+        for segment in segments:
+            if begin <= segment.first_date and segment.last_date <= end:
+                ranges = {}
+                for column in columns:
+                    summary = (
+                        getattr(segment, f"{column}_min"),
+                        getattr(segment, f"{column}_max"),
+                        segment.count,
+                        getattr(segment, f"{column}_sum"),
+                    )
+                    summaries[column].append(summary)
+                    ranges[column] = summary[:2]
+                self.parts.append((segment.path, None, None, segment.count, ranges))
+                continue
+            dates = read_segment_array(directory, segment.path, "date")
+            start = int(np.searchsorted(dates, np_begin, "left"))
+            stop = int(np.searchsorted(dates, np_end, "right"))
+            if start >= stop:
+                continue
+            ranges = {}
+            for column in columns:
+                values = read_segment_array(directory, segment.path, column)
+                values = values[start:stop]
+                summary = (
+                    float(values.min()),
+                    float(values.max()),
+                    stop - start,
+                    float(values.sum()),
+                )
+                summaries[column].append(summary)
+                ranges[column] = summary[:2]
+                self.bins[column] += sketch_bin_counts(values)
+            self.parts.append((segment.path, start, stop, stop - start, ranges))
+        self.aggregates = {
+            column: merge_aggregates(*summaries[column]) for column in columns
+        }
+
+    def band(self, column: str, low: float, high: float) -> tuple[int, np.ndarray]:
+        # Number of the readings below the band and the values within it.
+        # Segments entirely on one side of the band are not read.
+        below = 0
+        band = []
+        for path, start, stop, count, ranges in self.parts:
+            column_min, column_max = ranges[column]
+            if column_max < low:
+                below += count
+                continue
+            if column_min > high:
+                continue
+            values = read_segment_array(self.directory, path, column)[start:stop]
+            below += int(np.count_nonzero(values < low))
+            band.append(np.array(values[(values >= low) & (values <= high)]))
+        return below, np.concatenate(band) if band else np.empty(0)
+
+
+@label_queries
+class ArchiveStore:
+    def __init__(
+        self,
+        session: async_sessionmaker,
+        directory: str,
+        archive_after: timedelta,
+        interval: str,
+        compress: bool,
+    ) -> None:
+        self.session = session
+        self.directory = directory
+        self.archive_after = archive_after
+        self.interval = interval
+        self.compress = compress
+        # Files of segments expired in the current maintenance step, removed
+        # once the step is committed.
+        self.expired_paths = []
+
+    def horizon(self) -> datetime:
+        # Partitions that end before this are archived.
+        return partition_start(utc_now() - self.archive_after, self.interval)
+
+    async def export(
+        self, session: AsyncSession, name: str, lower: datetime, upper: datetime
+    ) -> None:
+        # Backfills into the partition wait until it is gone. The partition is
+        # dropped last, once its segments are written and recorded, so data
+        # stays locked only until the caller commits.
+        await session.execute(text(f"LOCK TABLE {name} IN SHARE MODE"))
+        stmt = text(
+            f"SELECT device_id, date, x, y, z FROM {name} ORDER BY device_id, date"
+        ).execution_options(yield_per=STREAM_CHUNK_SIZE)
+        segments = []
+        device_id = None
+        rows = []
+        result = await session.stream(stmt)
+        async for chunk in result.partitions():
+            for row in chunk:
+                if row[0] != device_id:
+                    if rows:
+                        segments.append(
+                            await self.write(name, lower, upper, device_id, rows)
+                        )
+                    device_id = row[0]
+                    rows = []
+                rows.append(row[1:])
+        if rows:
+            segments.append(await self.write(name, lower, upper, device_id, rows))
+
+        if segments:
+            segment_ids = await session.scalars(
+                insert(ArchiveSegmentModel).returning(
+                    ArchiveSegmentModel.id, sort_by_parameter_order=True
+                ),
+                [segment for segment, _ in segments],
+            )
+            await session.execute(
+                insert(ArchiveSketchModel),
+                [
+                    dict(sketch, segment_id=segment_id)
+                    for segment_id, (_, sketches) in zip(segment_ids, segments)
+                    for sketch in sketches
+                ],
+            )
+        await session.execute(text(f"DROP TABLE {name}"))
+        logger.info("Archived data partition %s (%d segments)", name, len(segments))
+
+    async def write(
+        self,
+        name: str,
+        lower: datetime,
+        upper: datetime,
+        device_id: int,
+        rows: list[tuple],
+    ) -> tuple[dict, list[dict]]:
+        dates = np.array([row[0] for row in rows], dtype="datetime64[us]")
+        values = np.array([row[1:] for row in rows], dtype=np.float64)
+        arrays = {"date": dates}
+        segment = {
+            "device_id": device_id,
+            "range_start": lower,
+            "range_stop": upper,
+            "first_date": rows[0][0],
+            "last_date": rows[-1][0],
+            "count": len(rows),
+            "path": segment_path(name, device_id, rows[0][0], self.compress),
+        }
+        sketches = []
+        for i, column in enumerate(COLUMNS):
+            arrays[column] = np.ascontiguousarray(values[:, i])
+            segment[f"{column}_min"] = float(values[:, i].min())
+            segment[f"{column}_max"] = float(values[:, i].max())
+            segment[f"{column}_sum"] = float(values[:, i].sum())
+            sketches += [
+                {"column_name": column, "sign": sign, "bin": bin, "count": count}
+                for sign, bin, count in sketch_bin_counts(arrays[column])
+            ]
+        await asyncio.to_thread(
+            write_segment, self.directory, segment["path"], arrays, self.compress
+        )
+        return segment, sketches
+
+    async def expired_ranges(
+        self, expired_before: datetime
+    ) -> list[tuple[datetime, datetime]]:
+        async with self.session() as session:
+            result = await session.execute(
+                select(ArchiveSegmentModel.range_start, ArchiveSegmentModel.range_stop)
+                .where(ArchiveSegmentModel.range_stop <= expired_before)
+                .distinct()
+                .order_by(ArchiveSegmentModel.range_start)
+            )
+            return result.all()
+
+    async def expire(
+        self, session: AsyncSession, lower: datetime, upper: datetime
+    ) -> list[dict]:
+        # Removes the segments of one archived range and returns the number
+        # of readings removed per device, in the form PartitionMaintainer.forget
+        # takes them. Their files are removed by remove_expired once the
+        # transaction is committed.
+        result = await session.execute(
+            delete(ArchiveSegmentModel)
+            .where(
+                (ArchiveSegmentModel.range_start == lower)
+                & (ArchiveSegmentModel.range_stop == upper)
+            )
+            .returning(
+                ArchiveSegmentModel.device_id,
+                ArchiveSegmentModel.count,
+                ArchiveSegmentModel.path,
+            )
+        )
+        counts = defaultdict(int)
+        self.expired_paths = []
+        for device_id, count, path in result:
+            counts[device_id] += count
+            self.expired_paths.append(path)
+        return [
+            {"b_device_id": device_id, "b_count": count}
+            for device_id, count in sorted(counts.items())
+        ]
+
+    def remove_expired(self) -> None:
+        for path in self.expired_paths:
+            remove_segment(self.directory, path)
+        self.expired_paths = []
+
+    async def archived_until(
+        self,
+        begin: datetime = None,
+        end: datetime = None,
+        device_id: int = None,
+        user_id: int = None,
+    ) -> datetime:
+        # End of the archived partitions with readings of the range, None if
+        # none of them has any.
+        where = device_filter(ArchiveSegmentModel.device_id, device_id, user_id)
+        if begin:
+            where &= ArchiveSegmentModel.last_date >= begin
+        if end:
+            where &= ArchiveSegmentModel.first_date <= end
+        async with self.session() as session:
+            return await session.scalar(
+                select(func.max(ArchiveSegmentModel.range_stop)).where(where)
+            )
+
+    async def archived_devices(
+        self, begin: datetime, end: datetime, device_ids: list[int]
+    ) -> set[int]:
+        # Devices of device_ids with archived readings in the range.
+        async with self.session() as session:
+            result = await session.scalars(
+                select(ArchiveSegmentModel.device_id)
+                .where(
+                    ArchiveSegmentModel.device_id.in_(device_ids)
+                    & (ArchiveSegmentModel.last_date >= begin)
+                    & (ArchiveSegmentModel.first_date <= end)
+                )
+                .distinct()
+            )
+            return set(result)
+
+    async def scan(
+        self,
+        columns: list[str],
+        begin: datetime,
+        end: datetime,
+        device_id: int = None,
+        user_id: int = None,
+    ) -> ArchiveScan:
+        in_range = (
+            device_filter(ArchiveSegmentModel.device_id, device_id, user_id)
+            & (ArchiveSegmentModel.first_date <= end)
+            & (ArchiveSegmentModel.last_date >= begin)
+        )
+        async with self.session() as session:
+            until = await session.scalar(
+                select(func.max(ArchiveSegmentModel.range_stop))
+            )
+            if until is None or begin >= until:
+                return None
+            result = await session.scalars(
+                select(ArchiveSegmentModel)
+                .where(in_range)
+                .order_by(ArchiveSegmentModel.first_date)
+            )
+            segments = result.all()
+            # Sketches of the segments that lie within the range as a whole.
+            result = await session.execute(
+                select(
+                    ArchiveSketchModel.column_name,
+                    ArchiveSketchModel.sign,
+                    ArchiveSketchModel.bin,
+                    func.sum(ArchiveSketchModel.count),
+                )
+                .join(ArchiveSegmentModel)
+                .where(
+                    in_range
+                    & (ArchiveSegmentModel.first_date >= begin)
+                    & (ArchiveSegmentModel.last_date <= end)
+                    & ArchiveSketchModel.column_name.in_(columns)
+                )
+                .group_by(
+                    ArchiveSketchModel.column_name,
+                    ArchiveSketchModel.sign,
+                    ArchiveSketchModel.bin,
+                )
+            )
+            bins = defaultdict(list)
+            for column, sign, bin, count in result:
+                bins[column].append((sign, bin, int(count)))
+        return await asyncio.to_thread(
+            ArchiveScan, self.directory, segments, bins, columns, begin, end, until
+        )
+
+    async def live_bands(
+        self,
+        bands: dict[str, tuple[float, float]],
+        begin: datetime,
+        end: datetime,
+        device_id: int = None,
+        user_id: int = None,
+    ) -> dict[str, tuple[int, int, np.ndarray]]:
+        # Number of live readings, of those below the band and the values
+        # within it, per column.
+        if begin > end:
+            return {column: (0, 0, np.empty(0)) for column in bands}
+        select_args = []
+        for column, (low, high) in bands.items():
+            data_column = getattr(DataModel, column)
+            select_args += [
+                func.count(data_column),
+                func.count().filter(data_column < low),
+                func.array_agg(data_column).filter(
+                    (data_column >= low) & (data_column <= high)
+                ),
+            ]
+        stmt = select(*select_args).where(
+            device_filter(DataModel.device_id, device_id, user_id)
+            & (DataModel.date >= begin)
+            & (DataModel.date <= end)
+        )
+        async with self.session() as session:
+            result = await session.execute(stmt)
+            row = result.one()
+        return {
+            column: (
+                row[i * 3],
+                row[i * 3 + 1],
+                np.array(row[i * 3 + 2] or [], dtype=np.float64),
+            )
+            for i, column in enumerate(bands)
+        }
+
+    async def medians(
+        self,
+        scan: ArchiveScan,
+        live_bins: dict[str, list[tuple[int, int, int]]],
+        begin: datetime,
+        end: datetime,
+        device_id: int = None,
+        user_id: int = None,
+    ) -> dict[str, float]:
+        """Exact medians of archived and live readings together. The sketch
+        bins of both parts narrow each median down to a band of values, and
+        only the values within it are read: from the table and from the
+        archive segments whose values overlap it. A band that turns out to
+        miss the middle ranks is widened and tried again."""
+        medians = {}
+        margins = {column: 1 for column in scan.columns}
+        while margins:
+            bands = {
+                column: band_limits(live_bins[column] + scan.bins[column], margin)
+                for column, margin in margins.items()
+            }
+            live = await self.live_bands(bands, begin, end, device_id, user_id)
+            for column, (low, high) in bands.items():
+                archived_below, archived_values = await asyncio.to_thread(
+                    scan.band, column, low, high
+                )
+                live_count, live_below, live_values = live[column]
+                count = scan.aggregates[column][2] + live_count
+                below = archived_below + live_below
+                values = np.sort(np.concatenate([archived_values, live_values]))
+                lower, upper = (count - 1) // 2 - below, count // 2 - below
+                if not count:
+                    medians[column] = None
+                elif 0 <= lower and upper < len(values):
+                    medians[column] = float(values[lower] + values[upper]) / 2
+                else:
+                    margins[column] *= 4
+                    continue
+                del margins[column]
+        return medians
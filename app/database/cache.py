@@ -0,0 +1,55 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class TTLCache:
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any:
+        item = self.items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value = item
+        if expires_at <= time.time():
+            del self.items[key]
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, expires_at: float = None) -> None:
+        if self.max_size <= 0:
+            return
+        ttl_expires_at = time.time() + self.ttl
+        if expires_at is None or expires_at > ttl_expires_at:
+            expires_at = ttl_expires_at
+        self.items[key] = (expires_at, value)
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self.items.pop(key, None)
+
+    def invalidate(self, predicate: Callable[[Hashable, Any], bool]) -> None:
+        for key in [k for k, (_, v) in self.items.items() if predicate(k, v)]:
+            del self.items[key]
+
+    def clear(self) -> None:
+        self.items.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
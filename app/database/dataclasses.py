@@ -22,6 +22,16 @@ class Data:
     y: float
     z: float
     date: datetime
+    device_id: int = None
+
+
+@dataclass
+class DataPeriod:
+    first_date: datetime
+    last_date: datetime
+    count: int
+    # Ingests that wrote readings dated at or before the last reading then.
+    backfills: int
 
 
 @dataclass
@@ -34,3 +44,15 @@ class Analysis:
     count: int
     sum: float
     median: float
+    median_error: float = None
+
+
+@dataclass
+class RollingWindow:
+    # Statistics of the window that ends with the reading at date.
+    date: datetime
+    count: int
+    mean: float
+    stddev: float
+    min_value: float
+    max_value: float
@@ -0,0 +1,16 @@
+from database.models import DeviceModel
+from sqlalchemy import ColumnElement, Select, select, true
+
+
+def user_device_ids(user_id: int) -> Select:
+    return select(DeviceModel.id).where(DeviceModel.user_id == user_id)
+
+
+def device_filter(
+    device_column: ColumnElement, device_id: int = None, user_id: int = None
+) -> ColumnElement:
+    if device_id:
+        return device_column == device_id
+    if user_id:
+        return device_column.in_(user_device_ids(user_id))
+    return true()
@@ -0,0 +1,179 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+from database.dataclasses import Analysis, Data
+from database.partitions import utc_now
+
+COLUMN_INDEX = {"x": 0, "y": 1, "z": 2}
+# datetime64[us] date plus three float64 values
+ROW_BYTES = 32
+INITIAL_ROWS = 64
+
+
+class DeviceWindow:
+    def __init__(self, evicted_until: np.datetime64 = None) -> None:
+        self.dates = np.empty(INITIAL_ROWS, dtype="datetime64[us]")
+        self.values = np.empty((INITIAL_ROWS, 3))
+        self.start = 0
+        self.end = 0
+        # Rows dated at or before this moment may have been dropped.
+        self.evicted_until = evicted_until
+
+    @property
+    def capacity(self) -> int:
+        return len(self.dates)
+
+    @property
+    def nbytes(self) -> int:
+        return self.capacity * ROW_BYTES
+
+    def evict(self, rows: int) -> None:
+        if rows <= 0:
+            return
+        last = self.dates[self.start : self.start + rows].max()
+        if self.evicted_until is None or last > self.evicted_until:
+            self.evicted_until = last
+        self.start += rows
+
+    def trim(self, cutoff: np.datetime64) -> None:
+        # Readings arrive roughly in date order, so expired rows are at the
+        # front of the buffer.
+        dates = self.dates[self.start : self.end]
+        expired = int(np.argmax(dates >= cutoff)) if len(dates) else 0
+        if len(dates) and dates[expired] < cutoff:
+            expired = len(dates)
+        self.evict(expired)
+
+    def reserve(self, rows: int, max_rows: int) -> None:
+        size = self.end - self.start
+        if size + rows > max_rows:
+            # Evicting a quarter at once keeps the compaction below amortized
+            # O(1) per appended row once the buffer is full.
+            self.evict(min(size, max(size + rows - max_rows, max_rows // 4)))
+            size = self.end - self.start
+        rows = min(rows, max_rows)
+        if self.end + rows <= self.capacity:
+            return
+        capacity = self.capacity
+        while size + rows > capacity:
+            capacity *= 2
+        capacity = min(capacity, max_rows)
+        dates = np.empty(capacity, dtype="datetime64[us]")
+        values = np.empty((capacity, 3))
+        dates[:size] = self.dates[self.start : self.end]
+        values[:size] = self.values[self.start : self.end]
+        self.dates, self.values = dates, values
+        self.start, self.end = 0, size
+
+    def append(self, data: list[Data], max_rows: int) -> None:
+        data = data[-max_rows:]
+        self.reserve(len(data), max_rows)
+        end = self.end + len(data)
+        self.dates[self.end : end] = [d.date for d in data]
+        self.values[self.end : end] = [(d.x, d.y, d.z) for d in data]
+        self.end = end
+
+    def select(self, begin: np.datetime64, end: np.datetime64) -> np.ndarray:
+        dates = self.dates[self.start : self.end]
+        mask = (dates >= begin) & (dates <= end)
+        return self.values[self.start : self.end][mask]
+
+
+class HotWindowCache:
+    def __init__(self, window: float, max_bytes: int, device_rows: int) -> None:
+        self.window = timedelta(seconds=window)
+        self.max_bytes = max_bytes
+        self.device_rows = device_rows
+        self.devices = OrderedDict()
+        # Devices dropped to honour the memory budget, with the date up to
+        # which their readings are gone.
+        self.evicted = {}
+        self.started_at = np.datetime64(utc_now(), "us")
+        # Running total of the buffers' sizes, so that ingest does not sum
+        # over every device.
+        self.nbytes = 0
+
+    def start(self) -> None:
+        self.devices.clear()
+        self.evicted.clear()
+        self.started_at = np.datetime64(utc_now(), "us")
+        self.nbytes = 0
+
+    def add(self, new_data: dict[int, list[Data]]) -> None:
+        cutoff = np.datetime64(utc_now() - self.window, "us")
+        for device_id, data in new_data.items():
+            window = self.devices.get(device_id)
+            if window is None:
+                window = DeviceWindow(self.evicted.pop(device_id, None))
+                self.devices[device_id] = window
+                self.nbytes += window.nbytes
+            self.devices.move_to_end(device_id)
+            window.trim(cutoff)
+            nbytes = window.nbytes
+            window.append(data, self.device_rows)
+            self.nbytes += window.nbytes - nbytes
+
+        while self.nbytes > self.max_bytes and len(self.devices) > 1:
+            device_id, window = self.devices.popitem(last=False)
+            self.nbytes -= window.nbytes
+            window.evict(window.end - window.start)
+            self.evicted[device_id] = window.evicted_until
+
+    def covers(self, begin: datetime, device_id: int = None) -> bool:
+        begin = np.datetime64(begin, "us")
+        if begin < self.started_at:
+            return False
+        if device_id:
+            window = self.devices.get(device_id)
+            evicted = [window.evicted_until] if window else []
+            evicted.append(self.evicted.get(device_id))
+        else:
+            evicted = [window.evicted_until for window in self.devices.values()]
+            evicted += list(self.evicted.values())
+        return all(until is None or begin > until for until in evicted)
+
+    def analysis(
+        self,
+        columns: list[str],
+        begin: datetime,
+        end: datetime,
+        device_id: int = None,
+    ) -> list[Analysis]:
+        if not self.covers(begin, device_id):
+            return None
+        np_begin = np.datetime64(begin, "us")
+        np_end = np.datetime64(end, "us")
+        if device_id:
+            windows = [self.devices[device_id]] if device_id in self.devices else []
+        else:
+            windows = self.devices.values()
+        parts = [window.select(np_begin, np_end) for window in windows]
+        values = np.concatenate(parts) if parts else np.empty((0, 3))
+
+        analysis = []
+        for column in columns:
+            column_values = values[:, COLUMN_INDEX[column]]
+            count = len(column_values)
+            analysis.append(
+                Analysis(
+                    column=column,
+                    begin_date=begin,
+                    end_date=end,
+                    min_value=float(column_values.min()) if count else None,
+                    max_value=float(column_values.max()) if count else None,
+                    count=count,
+                    sum=float(column_values.sum()) if count else None,
+                    median=float(np.median(column_values)) if count else None,
+                )
+            )
+        return analysis
+
+    def stats(self) -> dict:
+        return {
+            "devices": len(self.devices),
+            "rows": sum(w.end - w.start for w in self.devices.values()),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "evicted_devices": len(self.evicted),
+        }
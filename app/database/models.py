@@ -1,6 +1,18 @@
 from database.base import Base
-from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, String
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    DDL,
+    BigInteger,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    SmallInteger,
+    String,
+    event,
+)
+from sqlalchemy.orm import declared_attr, relationship
 from sqlalchemy.sql import func
 
 
@@ -16,19 +28,158 @@ class DeviceModel(Base):
     __tablename__ = "devices"
 
     id = Column(Integer, autoincrement=False, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
 
     user = relationship("UserModel")
 
 
 class DataModel(Base):
     __tablename__ = "data"
+    __table_args__ = (
+        Index(
+            "ix_data_device_id_date",
+            "device_id",
+            "date",
+            postgresql_include=["x", "y", "z"],
+        ),
+        Index("ix_data_date", "date", postgresql_include=["x", "y", "z"]),
+        # Partitions are created and dropped by database.partitions.
+        {"postgresql_partition_by": "RANGE (date)"},
+    )
 
     id = Column(Integer, autoincrement=True, primary_key=True)
     x = Column(Float)
     y = Column(Float)
     z = Column(Float)
-    date = Column(DateTime(), server_default=func.now())
+    date = Column(DateTime(), server_default=func.now(), primary_key=True)
     device_id = Column(Integer, ForeignKey("devices.id"))
 
     device = relationship("DeviceModel")
+
+
+# Readings outside of every range partition land here until the partition
+# maintenance moves them into a partition of their own.
+event.listen(
+    DataModel.__table__,
+    "after_create",
+    DDL("CREATE TABLE IF NOT EXISTS data_default PARTITION OF data DEFAULT"),
+)
+
+
+class DevicePeriodModel(Base):
+    __tablename__ = "device_periods"
+
+    device_id = Column(Integer, ForeignKey("devices.id"), primary_key=True)
+    first_date = Column(DateTime(), nullable=False)
+    last_date = Column(DateTime(), nullable=False)
+    count = Column(BigInteger, nullable=False)
+    backfills = Column(BigInteger, nullable=False, server_default="0")
+
+    device = relationship("DeviceModel")
+
+
+class DataRollupMixin:
+    # Partitioned like data, see database.partitions.
+    __table_args__ = {"postgresql_partition_by": "RANGE (bucket)"}
+
+    @declared_attr
+    def device_id(cls):
+        return Column(Integer, ForeignKey("devices.id"), primary_key=True)
+
+    # The all-devices analysis filters rollups on bucket alone.
+    bucket = Column(DateTime(), primary_key=True, index=True)
+    count = Column(BigInteger, nullable=False)
+    x_min = Column(Float)
+    x_max = Column(Float)
+    x_sum = Column(Float)
+    y_min = Column(Float)
+    y_max = Column(Float)
+    y_sum = Column(Float)
+    z_min = Column(Float)
+    z_max = Column(Float)
+    z_sum = Column(Float)
+
+
+class DataRollupMinuteModel(DataRollupMixin, Base):
+    __tablename__ = "data_rollup_minute"
+
+
+class DataRollupHourModel(DataRollupMixin, Base):
+    __tablename__ = "data_rollup_hour"
+
+
+class DataRollupDayModel(DataRollupMixin, Base):
+    __tablename__ = "data_rollup_day"
+
+
+class DataSketchModel(Base):
+    __tablename__ = "data_sketches"
+    __table_args__ = {"postgresql_partition_by": "RANGE (bucket)"}
+
+    device_id = Column(Integer, ForeignKey("devices.id"), primary_key=True)
+    bucket = Column(DateTime(), primary_key=True, index=True)
+    column_name = Column(String(1), primary_key=True)
+    sign = Column(SmallInteger, primary_key=True)
+    bin = Column(Integer, primary_key=True)
+    count = Column(BigInteger, nullable=False)
+
+
+for model in (
+    DataRollupMinuteModel,
+    DataRollupHourModel,
+    DataRollupDayModel,
+    DataSketchModel,
+):
+    event.listen(
+        model.__table__,
+        "after_create",
+        DDL(
+            f"CREATE TABLE IF NOT EXISTS {model.__tablename__}_default "
+            f"PARTITION OF {model.__tablename__} DEFAULT"
+        ),
+    )
+
+
+class ArchiveSegmentModel(Base):
+    __tablename__ = "archive_segments"
+    __table_args__ = (
+        Index("ix_archive_segments_device_id_first_date", "device_id", "first_date"),
+    )
+
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    device_id = Column(Integer, ForeignKey("devices.id"), nullable=False)
+    # Bounds of the partition the segment was exported from.
+    range_start = Column(DateTime(), nullable=False)
+    range_stop = Column(DateTime(), nullable=False, index=True)
+    first_date = Column(DateTime(), nullable=False)
+    last_date = Column(DateTime(), nullable=False)
+    count = Column(BigInteger, nullable=False)
+    x_min = Column(Float)
+    x_max = Column(Float)
+    x_sum = Column(Float)
+    y_min = Column(Float)
+    y_max = Column(Float)
+    y_sum = Column(Float)
+    z_min = Column(Float)
+    z_max = Column(Float)
+    z_sum = Column(Float)
+    # Relative to ARCHIVE_DIR.
+    path = Column(String, nullable=False)
+
+    device = relationship("DeviceModel")
+
+
+class ArchiveSketchModel(Base):
+    # Sketch bins of a whole archive segment, so that analysis does not have
+    # to read its values for an approximate median or to narrow an exact one.
+    __tablename__ = "archive_sketches"
+
+    segment_id = Column(
+        Integer,
+        ForeignKey("archive_segments.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    column_name = Column(String(1), primary_key=True)
+    sign = Column(SmallInteger, primary_key=True)
+    bin = Column(Integer, primary_key=True)
+    count = Column(BigInteger, nullable=False)
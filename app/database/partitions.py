@@ -0,0 +1,449 @@
+import asyncio
+import logging
+import re
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator
+
+from database.models import (
+    ArchiveSegmentModel,
+    DataModel,
+    DataRollupDayModel,
+    DataSketchModel,
+    DevicePeriodModel,
+)
+from database.rollups import ROLLUPS
+from metrics import label_queries
+from sqlalchemy import bindparam, func, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession, async_sessionmaker
+
+logger = logging.getLogger(__name__)
+
+INTERVALS = ("day", "month")
+# The readings and the rollups and sketches summarizing them are partitioned
+# with the same bounds, by the column below, so that a range is removed from
+# all of them by dropping partitions.
+PARTITIONED = {
+    DataModel.__tablename__: "date",
+    **{model.__tablename__: "bucket" for model, _ in ROLLUPS},
+    DataSketchModel.__tablename__: "bucket",
+}
+SUMMARIES = [table for table in PARTITIONED if table != DataModel.__tablename__]
+# Maintenance of concurrent workers is serialized by this session-level
+# advisory lock; a worker that does not get it skips the round.
+MAINTENANCE_LOCK = 0x64617461
+BOUNDS = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def partition_start(date: datetime, interval: str) -> datetime:
+    if interval == "day":
+        return datetime(date.year, date.month, date.day)
+    return datetime(date.year, date.month, 1)
+
+
+def next_partition_start(start: datetime, interval: str) -> datetime:
+    if interval == "day":
+        return start + timedelta(days=1)
+    if start.month == 12:
+        return datetime(start.year + 1, 1, 1)
+    return datetime(start.year, start.month + 1, 1)
+
+
+def partition_name(start: datetime, interval: str, table: str = "data") -> str:
+    if interval == "day":
+        return f"{table}_p{start:%Y%m%d}"
+    return f"{table}_p{start:%Y%m}"
+
+
+def default_partition(table: str = "data") -> str:
+    return f"{table}_default"
+
+
+DEFAULT_PARTITION = default_partition()
+
+
+def partition_ranges(
+    begin: datetime, end: datetime, interval: str
+) -> list[tuple[datetime, datetime]]:
+    # Consecutive partitions covering begin..end inclusive.
+    ranges = []
+    start = partition_start(begin, interval)
+    while start <= end:
+        stop = next_partition_start(start, interval)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def bounds_sql(start: datetime, stop: datetime) -> str:
+    return f"FROM ('{start.isoformat(sep=' ')}') TO ('{stop.isoformat(sep=' ')}')"
+
+
+def create_partition_sql(
+    start: datetime, stop: datetime, interval: str, table: str = "data"
+) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(start, interval, table)} "
+        f"PARTITION OF {table} FOR VALUES {bounds_sql(start, stop)}"
+    )
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+@label_queries
+class PartitionMaintainer:
+    def __init__(
+        self,
+        session: async_sessionmaker,
+        interval: str,
+        premake: int,
+        retention: timedelta,
+        retention_mode: str,
+        maintenance_interval: float,
+        lock_timeout: float,
+        archive=None,
+    ) -> None:
+        if interval not in INTERVALS:
+            raise ValueError(f"Unknown partition interval: {interval}")
+        if retention_mode not in ("drop", "detach"):
+            raise ValueError(f"Unknown retention mode: {retention_mode}")
+        self.session = session
+        self.interval = interval
+        self.premake = premake
+        self.retention = retention
+        self.retention_mode = retention_mode
+        self.maintenance_interval = maintenance_interval
+        self.lock_timeout = lock_timeout
+        # An ArchiveStore that exports old partitions before they are dropped.
+        self.archive = archive
+        self.task = None
+
+    def start(self) -> None:
+        if self.maintenance_interval > 0:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.maintain()
+            except Exception:
+                logger.exception("Failed to maintain data partitions")
+            await asyncio.sleep(self.maintenance_interval)
+
+    @asynccontextmanager
+    async def locked(self) -> AsyncIterator[AsyncConnection]:
+        # A connection holding the maintenance lock for the whole round, None
+        # when another worker holds it.
+        async with self.session.kw["bind"].connect() as connection:
+            locked = await connection.scalar(
+                select(func.pg_try_advisory_lock(MAINTENANCE_LOCK))
+            )
+            await connection.commit()
+            if not locked:
+                yield None
+                return
+            try:
+                yield connection
+            finally:
+                await connection.execute(
+                    select(func.pg_advisory_unlock(MAINTENANCE_LOCK))
+                )
+                await connection.commit()
+
+    @asynccontextmanager
+    async def transaction(
+        self, connection: AsyncConnection
+    ) -> AsyncIterator[AsyncSession]:
+        # One step of the round, committed on its own. A step waiting for a
+        # lock on a parent table queues every query behind it, so it gives up
+        # after lock_timeout; the round fails and is retried by the next one.
+        async with self.session(bind=connection) as session:
+            await session.execute(
+                text(f"SET LOCAL lock_timeout = {int(self.lock_timeout * 1000)}")
+            )
+            yield session
+            await session.commit()
+
+    async def maintain(self) -> bool:
+        # A dropped, detached or archived partition keeps its parent table
+        # locked until the commit, so every partition is created, removed or
+        # archived in a transaction of its own.
+        async with self.locked() as connection:
+            if connection is None:
+                return False
+            async with self.transaction(connection) as session:
+                partitions = {
+                    table: await self.partitions(session, table)
+                    for table in PARTITIONED
+                }
+                backfills = {
+                    table: await self.default_starts(session, table)
+                    for table in PARTITIONED
+                }
+            now = utc_now()
+            premake_end = now
+            for _ in range(self.premake):
+                premake_end = next_partition_start(
+                    partition_start(premake_end, self.interval), self.interval
+                )
+            expired_before = None
+            if self.retention:
+                expired_before = partition_start(now - self.retention, self.interval)
+            for table in PARTITIONED:
+                ranges = partition_ranges(now, premake_end, self.interval)
+                # Readings backfilled outside of the existing partitions.
+                # Ranges past retention are not recreated, their readings are
+                # expired instead.
+                for start in backfills[table]:
+                    stop = next_partition_start(start, self.interval)
+                    if not expired_before or stop > expired_before:
+                        ranges.append((start, stop))
+                for start, stop in ranges:
+                    await self.attach(connection, partitions[table], table, start, stop)
+            if expired_before:
+                await self.expire(connection, partitions, expired_before)
+            if self.archive:
+                await self.archive_partitions(
+                    connection, partitions[DataModel.__tablename__], expired_before
+                )
+        return True
+
+    async def partitions(
+        self, session: AsyncSession, table: str
+    ) -> dict[str, tuple[datetime, datetime]]:
+        stmt = text(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            f"WHERE i.inhparent = '{table}'::regclass"
+        )
+        partitions = {}
+        for name, bounds in await session.execute(stmt):
+            match = BOUNDS.search(bounds)
+            if match:
+                partitions[name] = (
+                    datetime.fromisoformat(match[1]),
+                    datetime.fromisoformat(match[2]),
+                )
+        return partitions
+
+    async def default_starts(self, session: AsyncSession, table: str) -> list[datetime]:
+        starts = await session.scalars(
+            text(
+                f"SELECT DISTINCT date_trunc('{self.interval}', {PARTITIONED[table]}) "
+                f"FROM {default_partition(table)}"
+            )
+        )
+        return starts.all()
+
+    async def attach(
+        self,
+        connection: AsyncConnection,
+        partitions: dict[str, tuple[datetime, datetime]],
+        table: str,
+        start: datetime,
+        stop: datetime,
+    ) -> None:
+        name = partition_name(start, self.interval, table)
+        if name in partitions:
+            return
+        for lower, upper in partitions.values():
+            if lower < stop and start < upper:
+                # Left over from a different interval; the existing partition
+                # keeps its range.
+                logger.warning(
+                    "Partition %s overlaps an existing one, not created", name
+                )
+                return
+        # Rows of the range may already sit in the default partition, and
+        # attaching fails unless they are moved out first.
+        async with self.transaction(connection) as session:
+            await session.execute(
+                text(
+                    f"CREATE TABLE {name} "
+                    f"(LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+                )
+            )
+            await session.execute(
+                text(
+                    f"WITH moved AS (DELETE FROM {default_partition(table)} "
+                    f"WHERE {PARTITIONED[table]} >= :start "
+                    f"AND {PARTITIONED[table]} < :stop RETURNING *) "
+                    f"INSERT INTO {name} SELECT * FROM moved"
+                ),
+                {"start": start, "stop": stop},
+            )
+            await session.execute(
+                text(
+                    f"ALTER TABLE {table} ATTACH PARTITION {name} "
+                    f"FOR VALUES {bounds_sql(start, stop)}"
+                )
+            )
+        partitions[name] = (start, stop)
+        logger.info("Created partition %s", name)
+
+    async def expire(
+        self,
+        connection: AsyncConnection,
+        partitions: dict[str, dict[str, tuple[datetime, datetime]]],
+        expired_before: datetime,
+    ) -> None:
+        # Oldest first: archived ranges, the partitions still in the table,
+        # then the rows left in the default partitions.
+        if self.archive:
+            for lower, upper in await self.archive.expired_ranges(expired_before):
+                async with self.transaction(connection) as session:
+                    counts = await self.archive.expire(session, lower, upper)
+                    await self.forget(session, partitions, lower, upper, counts)
+                self.archive.remove_expired()
+                logger.info("Removed archived range %s - %s", lower, upper)
+
+        data_partitions = partitions[DataModel.__tablename__]
+        for name, (lower, upper) in sorted(data_partitions.items(), key=lambda p: p[1]):
+            if upper > expired_before:
+                continue
+            async with self.transaction(connection) as session:
+                counts = await self.rollup_counts(session, lower, upper)
+                await self.forget(session, partitions, lower, upper, counts)
+                # DETACH CONCURRENTLY is refused while data has a default
+                # partition, so detaching locks data like dropping does.
+                if self.retention_mode == "drop":
+                    await session.execute(text(f"DROP TABLE {name}"))
+                else:
+                    await session.execute(
+                        text(f"ALTER TABLE data DETACH PARTITION {name}")
+                    )
+            del data_partitions[name]
+            logger.info("Removed data partition %s (%s)", name, self.retention_mode)
+
+        async with self.transaction(connection) as session:
+            result = await session.execute(
+                text(
+                    f"WITH expired AS (DELETE FROM {DEFAULT_PARTITION} "
+                    "WHERE date < :stop RETURNING device_id) "
+                    "SELECT device_id, count(*) FROM expired "
+                    "GROUP BY device_id ORDER BY device_id"
+                ),
+                {"stop": expired_before},
+            )
+            counts = [
+                {"b_device_id": device_id, "b_count": count}
+                for device_id, count in result
+            ]
+            await self.forget(session, partitions, datetime.min, expired_before, counts)
+
+    async def archive_partitions(
+        self,
+        connection: AsyncConnection,
+        partitions: dict[str, tuple[datetime, datetime]],
+        expired_before: datetime,
+    ) -> None:
+        # Each partition is written out and dropped in a transaction of its
+        # own, so data is locked by one drop at a time, not by the export of
+        # all the partitions after it.
+        horizon = self.archive.horizon()
+        for name, (lower, upper) in sorted(partitions.items(), key=lambda p: p[1]):
+            if upper > horizon or (expired_before and upper <= expired_before):
+                continue
+            async with self.transaction(connection) as session:
+                await self.archive.export(session, name, lower, upper)
+            del partitions[name]
+
+    async def rollup_counts(
+        self, session: AsyncSession, lower: datetime, upper: datetime
+    ) -> list[dict]:
+        # Readings per device of a partition, from its day rollups instead of
+        # a scan of the partition itself.
+        day = DataRollupDayModel
+        result = await session.execute(
+            select(day.device_id, func.sum(day.count))
+            .where((day.bucket >= lower) & (day.bucket < upper))
+            .group_by(day.device_id)
+            .order_by(day.device_id)
+        )
+        return [
+            {"b_device_id": device_id, "b_count": count} for device_id, count in result
+        ]
+
+    async def forget(
+        self,
+        session: AsyncSession,
+        partitions: dict[str, dict[str, tuple[datetime, datetime]]],
+        lower: datetime,
+        upper: datetime,
+        counts: list[dict],
+    ) -> None:
+        # Takes the readings of lower..upper, about to be removed, out of the
+        # device periods, then removes the rollups and sketches of the range.
+        # Ingest locks the same periods rows, sorted by device, before it
+        # writes rollups, sketches and readings; removing partitions comes
+        # last, so neither waits for the other holding what it needs.
+        if counts:
+            periods = DevicePeriodModel.__table__
+            await session.execute(
+                periods.delete().where(
+                    (periods.c.device_id == bindparam("b_device_id"))
+                    & (periods.c.count <= bindparam("b_count"))
+                ),
+                counts,
+            )
+            # Bumping backfills makes cached analyses of these devices stale.
+            # Archived readings are older than those still in the table.
+            first_date = func.coalesce(
+                select(func.min(ArchiveSegmentModel.first_date))
+                .where(
+                    (ArchiveSegmentModel.device_id == periods.c.device_id)
+                    & (ArchiveSegmentModel.range_start >= upper)
+                )
+                .scalar_subquery(),
+                func.least(
+                    select(func.min(DataModel.date))
+                    .where(
+                        (DataModel.device_id == periods.c.device_id)
+                        & (DataModel.date < lower)
+                    )
+                    .scalar_subquery(),
+                    select(func.min(DataModel.date))
+                    .where(
+                        (DataModel.device_id == periods.c.device_id)
+                        & (DataModel.date >= upper)
+                    )
+                    .scalar_subquery(),
+                ),
+            )
+            await session.execute(
+                periods.update()
+                .where(periods.c.device_id == bindparam("b_device_id"))
+                .values(
+                    count=periods.c.count - bindparam("b_count"),
+                    backfills=periods.c.backfills + 1,
+                    first_date=first_date,
+                ),
+                counts,
+            )
+        # Partition bounds fall on day boundaries, so every rollup and sketch
+        # bucket is either entirely inside the removed range or outside it.
+        for table in SUMMARIES:
+            name = partition_name(lower, self.interval, table)
+            if partitions[table].get(name) == (lower, upper):
+                await session.execute(text(f"DROP TABLE {name}"))
+                del partitions[table][name]
+            else:
+                await session.execute(
+                    text(
+                        f"DELETE FROM {default_partition(table)} "
+                        "WHERE bucket >= :lower AND bucket < :upper"
+                    ),
+                    {"lower": lower, "upper": upper},
+                )
@@ -0,0 +1,123 @@
+import asyncio
+from collections import deque
+
+from database.dataclasses import Data
+
+
+class Subscription:
+    def __init__(self, topic: tuple[str, int], max_size: int) -> None:
+        self.topic = topic
+        self.max_size = max_size
+        self.pending = deque()
+        self.event = asyncio.Event()
+        self.closed = False
+        # Set when the subscriber fell so far behind that it was disconnected.
+        self.dropped = False
+        self.coalesced = 0
+
+    def push(self, device_id: int, data: Data) -> bool:
+        if self.closed:
+            return False
+        if len(self.pending) >= self.max_size:
+            self.coalesce()
+            if len(self.pending) >= self.max_size:
+                self.dropped = True
+                self.close()
+                return False
+        self.pending.append((device_id, data))
+        self.event.set()
+        return True
+
+    def coalesce(self) -> None:
+        # A lagging subscriber only gets the latest pending reading per device.
+        latest = {}
+        for device_id, data in self.pending:
+            latest[device_id] = data
+        self.coalesced += len(self.pending) - len(latest)
+        self.pending = deque(latest.items())
+
+    def close(self) -> None:
+        self.closed = True
+        self.event.set()
+
+    async def get(self, timeout: float = None) -> list[tuple[int, Data]]:
+        # Waits for pending readings and takes all of them; returns an empty
+        # list on timeout or once the subscription is closed.
+        if not self.pending and not self.closed:
+            try:
+                await asyncio.wait_for(self.event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self.event.clear()
+        readings = list(self.pending)
+        self.pending.clear()
+        return readings
+
+
+class PubSubHub:
+    def __init__(self, queue_size: int, max_subscribers: int) -> None:
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.topics = {}
+        self.subscribers = 0
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def subscribe(self, kind: str, id: int) -> Subscription:
+        if self.subscribers >= self.max_subscribers:
+            return None
+        topic = (kind, id)
+        subscription = Subscription(topic, self.queue_size)
+        self.topics.setdefault(topic, set()).add(subscription)
+        self.subscribers += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscription.close()
+        subscriptions = self.topics.get(subscription.topic)
+        if subscriptions is None or subscription not in subscriptions:
+            return
+        subscriptions.discard(subscription)
+        self.coalesced += subscription.coalesced
+        if not subscriptions:
+            del self.topics[subscription.topic]
+        self.subscribers -= 1
+
+    def publish(self, new_data: dict[int, list[Data]], owners: dict[int, int]) -> None:
+        self.published += sum(len(data) for data in new_data.values())
+        if not self.topics:
+            return
+        for device_id, data in new_data.items():
+            for topic in (("device", device_id), ("user", owners.get(device_id))):
+                for subscription in list(self.topics.get(topic, ())):
+                    for reading in data:
+                        if subscription.push(device_id, reading):
+                            self.delivered += 1
+                        else:
+                            self.dropped += 1
+                            self.unsubscribe(subscription)
+                            break
+
+    def close(self) -> None:
+        for subscriptions in list(self.topics.values()):
+            for subscription in list(subscriptions):
+                self.unsubscribe(subscription)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": self.subscribers,
+            "topics": len(self.topics),
+            "max_subscribers": self.max_subscribers,
+            "queue_size": self.queue_size,
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped_subscribers": self.dropped,
+            "coalesced": self.coalesced
+            + sum(
+                subscription.coalesced
+                for subscriptions in self.topics.values()
+                for subscription in subscriptions
+            ),
+        }
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+
+from database.cache import TTLCache
+from database.models import DeviceModel
+from metrics import label_queries
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+logger = logging.getLogger(__name__)
+
+
+@label_queries
+class DeviceRegistry:
+    def __init__(
+        self,
+        session: async_sessionmaker,
+        refresh_interval: float,
+        negative_ttl: float,
+        negative_size: int,
+    ) -> None:
+        self.session = session
+        self.refresh_interval = refresh_interval
+        # device id -> owner user id
+        self.devices = {}
+        # Ids recently looked up and not found. Devices created by another
+        # worker become visible here once their entry expires.
+        self.missing = TTLCache(negative_size, negative_ttl)
+        self.task = None
+
+    def start(self) -> None:
+        if self.refresh_interval > 0:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh the device registry")
+
+    async def refresh(self) -> None:
+        stmt = select(DeviceModel.id, DeviceModel.user_id)
+        async with self.session() as session:
+            result = await session.execute(stmt)
+            self.devices = {id: user_id for id, user_id in result}
+        self.missing.clear()
+
+    def add(self, id: int, user_id: int) -> None:
+        self.devices[id] = user_id
+        self.missing.pop(id)
+
+    async def exists(self, id: int) -> bool:
+        known_ids = await self.known(id)
+        return id in known_ids
+
+    async def known(self, *ids: int) -> set[int]:
+        known_ids = {id for id in ids if id in self.devices}
+        lookup_ids = [
+            id for id in ids if id not in known_ids and self.missing.get(id) is None
+        ]
+        if not lookup_ids:
+            return known_ids
+
+        stmt = select(DeviceModel.id, DeviceModel.user_id).where(
+            DeviceModel.id.in_(lookup_ids)
+        )
+        async with self.session() as session:
+            result = await session.execute(stmt)
+            for id, user_id in result:
+                self.add(id, user_id)
+                known_ids.add(id)
+        for id in lookup_ids:
+            if id not in known_ids:
+                self.missing.set(id, True)
+        return known_ids
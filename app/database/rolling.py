@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta
+
+from database.base import async_session
+from database.dataclasses import RollingWindow
+from database.filters import device_filter
+from database.models import DataModel
+from sqlalchemy import Float, Select, cast, func, literal_column, select
+
+UNITS = ("rows", "seconds")
+# Statistics of a window with the Postgres aggregates computing them.
+STATISTICS = (
+    ("count", "count"),
+    ("mean", "avg"),
+    ("stddev", "stddev_samp"),
+    ("min", "min"),
+    ("max", "max"),
+)
+
+
+class TooManyWindows(Exception):
+    pass
+
+
+class RollingAnalyst:
+    def __init__(
+        self,
+        columns: list[str],
+        begin: datetime,
+        end: datetime,
+        window: float,
+        step: float = None,
+        unit: str = "seconds",
+        device_id: int = None,
+        user_id: int = None,
+    ) -> None:
+        if unit not in UNITS:
+            raise ValueError(f"Unknown window unit: {unit}")
+        self.session = async_session
+        self.columns = columns
+        self.begin_date = begin
+        self.end_date = end
+        self.window = window
+        self.step = step
+        self.unit = unit
+        self.device_id = device_id
+        self.user_id = user_id
+
+    def where(self, begin: datetime):
+        return (
+            device_filter(DataModel.device_id, self.device_id, self.user_id)
+            & (DataModel.date >= begin)
+            & (DataModel.date <= self.end_date)
+        )
+
+    def statistics(self) -> list:
+        # All statistics are aggregates over the one named window w, so
+        # Postgres computes them in a single pass over the sorted readings.
+        select_args = []
+        for column in self.columns:
+            for statistic, function in STATISTICS:
+                select_args.append(
+                    literal_column(f"{function}(data.{column}) OVER w").label(
+                        f"{column}_{statistic}"
+                    )
+                )
+        return select_args
+
+    def rows_select(self) -> Select:
+        # A window of the last `window` readings after every `step` readings,
+        # starting with the first full window.
+        size = max(int(self.window), 1)
+        step = max(int(self.step or 1), 1)
+        position = func.row_number().over(order_by=(DataModel.date, DataModel.id))
+        windows = (
+            select(DataModel.date, position.label("position"), *self.statistics())
+            .where(self.where(self.begin_date))
+            .suffix_with(
+                "WINDOW w AS (ORDER BY data.date, data.id "
+                f"ROWS BETWEEN {size - 1} PRECEDING AND CURRENT ROW)"
+            )
+            .subquery()
+        )
+        return (
+            select(windows)
+            .where(
+                (windows.c.position >= size) & ((windows.c.position - size) % step == 0)
+            )
+            .order_by(windows.c.position)
+        )
+
+    def seconds_select(self) -> Select:
+        # A window of the readings of the last `window` seconds at the last
+        # reading of every `step` seconds since begin. Readings just before
+        # begin are read too, so that the first windows are full.
+        window = timedelta(seconds=self.window)
+        microseconds = window // timedelta(microseconds=1)
+        select_args = [DataModel.date, *self.statistics()]
+        if self.step:
+            offset = cast(
+                func.extract("epoch", DataModel.date - self.begin_date), Float
+            )
+            bucket = func.floor(offset / self.step)
+            select_args += [
+                bucket.label("bucket"),
+                func.lead(bucket).over(order_by=DataModel.date).label("next_bucket"),
+            ]
+        windows = (
+            select(*select_args)
+            .where(self.where(self.begin_date - window))
+            .suffix_with(
+                "WINDOW w AS (ORDER BY data.date RANGE BETWEEN "
+                f"INTERVAL '{microseconds} microseconds' PRECEDING AND CURRENT ROW)"
+            )
+            .subquery()
+        )
+        stmt = (
+            select(windows)
+            .where(windows.c.date >= self.begin_date)
+            .order_by(windows.c.date)
+        )
+        if self.step:
+            stmt = stmt.where(windows.c.next_bucket.is_distinct_from(windows.c.bucket))
+        return stmt
+
+    async def windows(self, max_windows: int) -> dict[str, list[RollingWindow]]:
+        if self.unit == "rows":
+            stmt = self.rows_select()
+        else:
+            stmt = self.seconds_select()
+        stmt = stmt.limit(max_windows + 1)
+
+        windows = {column: [] for column in self.columns}
+        async with self.session() as session:
+            result = await session.execute(stmt)
+            rows = result.mappings().all()
+        if len(rows) > max_windows:
+            raise TooManyWindows(len(rows))
+        for row in rows:
+            for column in self.columns:
+                windows[column].append(
+                    RollingWindow(
+                        date=row["date"],
+                        count=row[f"{column}_count"],
+                        mean=row[f"{column}_mean"],
+                        stddev=row[f"{column}_stddev"],
+                        min_value=row[f"{column}_min"],
+                        max_value=row[f"{column}_max"],
+                    )
+                )
+        return windows
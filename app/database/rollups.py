@@ -0,0 +1,197 @@
+from datetime import datetime, timedelta
+
+from database.base import async_session
+from database.dataclasses import Data
+from database.filters import device_filter
+from database.models import (
+    DataModel,
+    DataRollupDayModel,
+    DataRollupHourModel,
+    DataRollupMinuteModel,
+)
+from sqlalchemy import Insert, Select, cast, func, literal, select, union_all
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import insert as insert_psql
+
+COLUMNS = ("x", "y", "z")
+
+# From the coarsest bucket to the finest one.
+ROLLUPS = (
+    (DataRollupDayModel, timedelta(days=1)),
+    (DataRollupHourModel, timedelta(hours=1)),
+    (DataRollupMinuteModel, timedelta(minutes=1)),
+)
+
+ROLLUP_KEYS = ("device_id", "bucket", "count") + tuple(
+    f"{column}_{statistic}" for column in COLUMNS for statistic in ("min", "max", "sum")
+)
+
+# Dates are stored with microsecond precision, so an inclusive end date
+# becomes an exclusive stop one microsecond later.
+RESOLUTION = timedelta(microseconds=1)
+
+
+def bucket_start(date: datetime, width: timedelta) -> datetime:
+    return datetime.min + (date - datetime.min) // width * width
+
+
+def rollup_rows(new_data: dict[int, list[Data]], width: timedelta) -> list[dict]:
+    buckets = {}
+    for device_id, data in new_data.items():
+        for d in data:
+            key = (device_id, bucket_start(d.date, width))
+            row = buckets.get(key)
+            if row is None:
+                row = {"device_id": device_id, "bucket": key[1], "count": 0}
+                for column in COLUMNS:
+                    value = getattr(d, column)
+                    row[f"{column}_min"] = value
+                    row[f"{column}_max"] = value
+                    row[f"{column}_sum"] = 0.0
+                buckets[key] = row
+            row["count"] += 1
+            for column in COLUMNS:
+                value = getattr(d, column)
+                row[f"{column}_min"] = min(row[f"{column}_min"], value)
+                row[f"{column}_max"] = max(row[f"{column}_max"], value)
+                row[f"{column}_sum"] += value
+    # Concurrent writers lock the buckets in the same order, so that they
+    # wait for each other instead of deadlocking.
+    return [buckets[key] for key in sorted(buckets)]
+
+
+def unnest_rows(model: type, rows: list[dict]) -> Select:
+    # One array parameter per column, so the statement stays the same and
+    # within the parameter limit whatever the number of rows.
+    arrays = []
+    for key in ROLLUP_KEYS:
+        array_type = ARRAY(model.__table__.c[key].type)
+        arrays.append(cast(literal([row[key] for row in rows], array_type), array_type))
+    rows_table = (
+        func.unnest(*arrays)
+        .table_valued(*ROLLUP_KEYS)
+        .render_derived(name=f"{model.__tablename__}_rows")
+    )
+    return select(rows_table)
+
+
+def rollup_upsert(model: type, rows: list[dict]) -> Insert:
+    stmt = insert_psql(model).from_select(ROLLUP_KEYS, unnest_rows(model, rows))
+    set_ = {"count": model.count + stmt.excluded.count}
+    for column in COLUMNS:
+        column_min = getattr(model, f"{column}_min")
+        column_max = getattr(model, f"{column}_max")
+        column_sum = getattr(model, f"{column}_sum")
+        set_[column_min.key] = func.least(
+            column_min, getattr(stmt.excluded, column_min.key)
+        )
+        set_[column_max.key] = func.greatest(
+            column_max, getattr(stmt.excluded, column_max.key)
+        )
+        set_[column_sum.key] = column_sum + getattr(stmt.excluded, column_sum.key)
+    return stmt.on_conflict_do_update(index_elements=["device_id", "bucket"], set_=set_)
+
+
+def rollups_upsert(new_data: dict[int, list[Data]]) -> Insert:
+    # Every resolution in one statement: the finer rollups are upserted by
+    # data-modifying CTEs of the coarsest one's upsert.
+    (model, width), *finer = ROLLUPS
+    ctes = [
+        rollup_upsert(finer_model, rollup_rows(new_data, finer_width)).cte(
+            f"{finer_model.__tablename__}_upsert"
+        )
+        for finer_model, finer_width in finer
+    ]
+    return rollup_upsert(model, rollup_rows(new_data, width)).add_cte(*ctes)
+
+
+def split_period(
+    begin: datetime, stop: datetime, rollups: tuple = ROLLUPS
+) -> tuple[list[tuple[type, datetime, datetime]], list[tuple[datetime, datetime]]]:
+    """Splits [begin, stop) into runs of whole buckets, coarsest first,
+    and the leftover raw edges that no bucket covers completely."""
+    if begin >= stop:
+        return [], []
+    if not rollups:
+        return [], [(begin, stop)]
+
+    (model, width), finer = rollups[0], rollups[1:]
+    first = bucket_start(begin, width)
+    if first < begin:
+        first += width
+    last = bucket_start(stop, width)
+    if first >= last:
+        return split_period(begin, stop, finer)
+
+    head_buckets, head_raw = split_period(begin, first, finer)
+    tail_buckets, tail_raw = split_period(last, stop, finer)
+    buckets = head_buckets + [(model, first, last)] + tail_buckets
+    return buckets, head_raw + tail_raw
+
+
+class RollupAnalyst:
+    def __init__(
+        self,
+        columns: list[str],
+        begin: datetime,
+        end: datetime,
+        device_id: int = None,
+        user_id: int = None,
+    ) -> None:
+        self.session = async_session
+        self.columns = columns
+        self.device_id = device_id
+        self.user_id = user_id
+        self.buckets, self.raw = split_period(begin, end + RESOLUTION)
+
+    def bucket_select(self, model: type, first: datetime, last: datetime) -> Select:
+        select_args = [func.sum(model.count).label("count")]
+        for column in self.columns:
+            select_args += [
+                func.min(getattr(model, f"{column}_min")).label(f"{column}_min"),
+                func.max(getattr(model, f"{column}_max")).label(f"{column}_max"),
+                func.sum(getattr(model, f"{column}_sum")).label(f"{column}_sum"),
+            ]
+        return select(*select_args).where(
+            device_filter(model.device_id, self.device_id, self.user_id)
+            & (model.bucket >= first)
+            & (model.bucket < last)
+        )
+
+    def raw_select(self, begin: datetime, stop: datetime) -> Select:
+        select_args = [func.count().label("count")]
+        for column in self.columns:
+            data_column = getattr(DataModel, column)
+            select_args += [
+                func.min(data_column).label(f"{column}_min"),
+                func.max(data_column).label(f"{column}_max"),
+                func.sum(data_column).label(f"{column}_sum"),
+            ]
+        return select(*select_args).where(
+            device_filter(DataModel.device_id, self.device_id, self.user_id)
+            & (DataModel.date >= begin)
+            & (DataModel.date < stop)
+        )
+
+    async def aggregates(self) -> dict[str, tuple]:
+        parts = [self.bucket_select(*bucket) for bucket in self.buckets]
+        parts += [self.raw_select(*raw) for raw in self.raw]
+        merged = union_all(*parts).subquery()
+
+        select_args = [func.coalesce(func.sum(merged.c["count"]), 0)]
+        for column in self.columns:
+            select_args += [
+                func.min(merged.c[f"{column}_min"]),
+                func.max(merged.c[f"{column}_max"]),
+                func.sum(merged.c[f"{column}_sum"]),
+            ]
+        async with self.session() as session:
+            result = await session.execute(select(*select_args))
+            row = result.one()
+
+        count = row[0]
+        aggregates = {}
+        for i, column in enumerate(self.columns):
+            min_value, max_value, sum = row[1 + i * 3 : 4 + i * 3]
+            aggregates[column] = (min_value, max_value, count, sum)
+        return aggregates
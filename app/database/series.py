@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+from database.base import async_session
+from database.models import DataModel
+from sqlalchemy import Float, cast, func, select
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class TooManyReadings(Exception):
+    pass
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: indices of at most `threshold`
+    points of (x, y) that keep the visual shape of the series."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    edges = (np.arange(threshold - 1) * every).astype(int) + 1
+    edges[-1] = n - 1
+
+    indices = np.empty(threshold, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[stop:next_stop].mean()
+        avg_y = y[stop:next_stop].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:stop] - y[a])
+            - (x[a] - x[start:stop]) * (avg_y - y[a])
+        )
+        a = start + int(area.argmax())
+        indices[i + 1] = a
+    return indices
+
+
+def to_datetime(seconds: float) -> datetime:
+    return EPOCH + timedelta(seconds=float(seconds))
+
+
+class SeriesAnalyst:
+    def __init__(
+        self,
+        device_id: int,
+        columns: list[str],
+        begin: datetime,
+        end: datetime,
+        points: int,
+    ) -> None:
+        self.session = async_session
+        self.device_id = device_id
+        self.columns = columns
+        self.begin_date = begin
+        self.end_date = end
+        self.points = points
+
+    def where(self):
+        return (
+            (DataModel.device_id == self.device_id)
+            & (DataModel.date >= self.begin_date)
+            & (DataModel.date <= self.end_date)
+        )
+
+    async def buckets(self) -> dict[str, list[tuple[datetime, float]]]:
+        seconds = (self.end_date - self.begin_date).total_seconds()
+        width = max(seconds / self.points, 1e-6)
+        offset = cast(func.extract("epoch", DataModel.date - self.begin_date), Float)
+        bucket = func.least(func.floor(offset / width), self.points - 1).label("bucket")
+        select_args = [bucket] + [
+            func.avg(getattr(DataModel, column)) for column in self.columns
+        ]
+        stmt = (
+            select(*select_args).where(self.where()).group_by(bucket).order_by(bucket)
+        )
+
+        series = {column: [] for column in self.columns}
+        async with self.session() as session:
+            result = await session.execute(stmt)
+            for bucket, *values in result:
+                date = self.begin_date + timedelta(seconds=(bucket + 0.5) * width)
+                for column, value in zip(self.columns, values):
+                    series[column].append((date, value))
+        return series
+
+    async def lttb(
+        self, max_rows: int, chunk_size: int
+    ) -> dict[str, list[tuple[datetime, float]]]:
+        select_args = [cast(func.extract("epoch", DataModel.date), Float)] + [
+            getattr(DataModel, column) for column in self.columns
+        ]
+        stmt = (
+            select(*select_args)
+            .where(self.where())
+            .order_by(DataModel.date)
+            .execution_options(yield_per=chunk_size)
+        )
+        chunks = []
+        rows = 0
+        async with self.session() as session:
+            result = await session.stream(stmt)
+            async for partition in result.partitions():
+                chunks.append(np.array(partition, dtype=float))
+                rows += len(partition)
+                if rows > max_rows:
+                    raise TooManyReadings(rows)
+        values = (
+            np.concatenate(chunks) if chunks else np.empty((0, 1 + len(self.columns)))
+        )
+
+        series = {}
+        for i, column in enumerate(self.columns, start=1):
+            present = ~np.isnan(values[:, i])
+            x, y = values[present, 0], values[present, i]
+            indices = lttb(x, y, self.points)
+            series[column] = [(to_datetime(x[j]), float(y[j])) for j in indices]
+        return series
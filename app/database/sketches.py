@@ -0,0 +1,190 @@
+import math
+from datetime import datetime, timedelta
+
+import numpy as np
+from config import SKETCH_RELATIVE_ACCURACY
+from database.base import async_session
+from database.dataclasses import Data
+from database.filters import device_filter
+from database.models import DataModel, DataSketchModel
+from database.rollups import COLUMNS, RESOLUTION, bucket_start, split_period
+from sqlalchemy import Insert, Select, case, func, literal, select, union_all
+from sqlalchemy.dialects.postgresql import insert as insert_psql
+
+# A mergeable quantile sketch in the spirit of DDSketch: every value falls
+# into a logarithmic bin, so any value rebuilt from its bin is within
+# SKETCH_RELATIVE_ACCURACY of the original, and sketches of different
+# devices and buckets merge by adding bin counts, which SQL can do.
+GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+# Values this close to zero share the zero bin.
+MIN_VALUE = 1e-9
+
+SKETCH_BUCKET = timedelta(hours=1)
+
+
+def sketch_bin(value: float) -> tuple[int, int]:
+    if abs(value) < MIN_VALUE:
+        return 0, 0
+    sign = 1 if value > 0 else -1
+    return sign, math.ceil(math.log(abs(value)) / LOG_GAMMA)
+
+
+def bin_value(sign: int, bin: int) -> float:
+    if sign == 0:
+        return 0.0
+    return sign * 2 * GAMMA**bin / (GAMMA + 1)
+
+
+def bin_bounds(sign: int, bin: int) -> tuple[float, float]:
+    # Smallest and largest value that can fall into the bin.
+    if sign == 0:
+        return -MIN_VALUE, MIN_VALUE
+    if sign > 0:
+        return GAMMA ** (bin - 1), GAMMA**bin
+    return -(GAMMA**bin), -(GAMMA ** (bin - 1))
+
+
+def sketch_bin_counts(values: np.ndarray) -> list[tuple[int, int, int]]:
+    # sketch_bin of every value, counted; for readings outside of Postgres.
+    magnitude = np.abs(values)
+    is_zero = magnitude < MIN_VALUE
+    signs = np.where(is_zero, 0, np.sign(values)).astype(np.int64)
+    with np.errstate(divide="ignore"):
+        bins = np.where(is_zero, 0, np.ceil(np.log(magnitude) / LOG_GAMMA))
+    pairs, counts = np.unique(
+        np.stack([signs, bins.astype(np.int64)], axis=1), axis=0, return_counts=True
+    )
+    return [
+        (sign, bin, count)
+        for (sign, bin), count in zip(pairs.tolist(), counts.tolist())
+    ]
+
+
+def sketch_rows(new_data: dict[int, list[Data]]) -> list[dict]:
+    bins = {}
+    for device_id, data in new_data.items():
+        for d in data:
+            bucket = bucket_start(d.date, SKETCH_BUCKET)
+            for column in COLUMNS:
+                sign, bin = sketch_bin(getattr(d, column))
+                key = (device_id, bucket, column, sign, bin)
+                bins[key] = bins.get(key, 0) + 1
+    # Sorted by the conflict key, like the rollup rows.
+    return [
+        {
+            "device_id": device_id,
+            "bucket": bucket,
+            "column_name": column,
+            "sign": sign,
+            "bin": bin,
+            "count": count,
+        }
+        for (device_id, bucket, column, sign, bin), count in sorted(bins.items())
+    ]
+
+
+def sketch_upsert() -> Insert:
+    stmt = insert_psql(DataSketchModel)
+    return stmt.on_conflict_do_update(
+        index_elements=["device_id", "bucket", "column_name", "sign", "bin"],
+        set_={"count": DataSketchModel.count + stmt.excluded.count},
+    )
+
+
+def sketch_quantile(bins: list[tuple[int, int, int]], quantile: float) -> float:
+    if not bins:
+        return None
+    # Negative bins grow in magnitude with the bin number, so they go first
+    # in reverse order, then the zero bin, then the positive ones.
+    bins = sorted(bins, key=lambda b: (b[0], b[1] * b[0]))
+    total = sum(count for _, _, count in bins)
+    rank = quantile * (total - 1)
+    seen = 0
+    for sign, bin, count in bins:
+        seen += count
+        if seen > rank:
+            return bin_value(sign, bin)
+    sign, bin, _ = bins[-1]
+    return bin_value(sign, bin)
+
+
+class SketchAnalyst:
+    def __init__(
+        self,
+        columns: list[str],
+        begin: datetime,
+        end: datetime,
+        device_id: int = None,
+        user_id: int = None,
+    ) -> None:
+        self.session = async_session
+        self.columns = columns
+        self.device_id = device_id
+        self.user_id = user_id
+        self.buckets, self.raw = split_period(
+            begin, end + RESOLUTION, ((DataSketchModel, SKETCH_BUCKET),)
+        )
+
+    def bucket_select(self, first: datetime, last: datetime) -> Select:
+        return select(
+            DataSketchModel.column_name,
+            DataSketchModel.sign,
+            DataSketchModel.bin,
+            DataSketchModel.count,
+        ).where(
+            device_filter(DataSketchModel.device_id, self.device_id, self.user_id)
+            & DataSketchModel.column_name.in_(self.columns)
+            & (DataSketchModel.bucket >= first)
+            & (DataSketchModel.bucket < last)
+        )
+
+    def raw_select(self, column: str, begin: datetime, stop: datetime) -> Select:
+        data_column = getattr(DataModel, column)
+        is_zero = func.abs(data_column) < MIN_VALUE
+        sign = case((is_zero, 0), else_=func.sign(data_column)).label("sign")
+        bin = case(
+            (is_zero, 0),
+            else_=func.ceil(func.ln(func.abs(data_column)) / LOG_GAMMA),
+        ).label("bin")
+        return (
+            select(
+                literal(column).label("column_name"),
+                sign,
+                bin,
+                func.count().label("count"),
+            )
+            .where(
+                device_filter(DataModel.device_id, self.device_id, self.user_id)
+                & data_column.is_not(None)
+                & (DataModel.date >= begin)
+                & (DataModel.date < stop)
+            )
+            .group_by(sign, bin)
+        )
+
+    async def bins(self) -> dict[str, list[tuple[int, int, int]]]:
+        parts = [self.bucket_select(first, last) for _, first, last in self.buckets]
+        parts += [
+            self.raw_select(column, begin, stop)
+            for begin, stop in self.raw
+            for column in self.columns
+        ]
+        merged = union_all(*parts).subquery()
+        stmt = select(
+            merged.c.column_name,
+            merged.c.sign,
+            merged.c.bin,
+            func.sum(merged.c["count"]),
+        ).group_by(merged.c.column_name, merged.c.sign, merged.c.bin)
+
+        bins = {column: [] for column in self.columns}
+        async with self.session() as session:
+            result = await session.execute(stmt)
+            for column, sign, bin, count in result:
+                bins[column].append((int(sign), int(bin), count))
+        return bins
+
+    async def medians(self) -> dict[str, float]:
+        bins = await self.bins()
+        return {column: sketch_quantile(bins[column], 0.5) for column in self.columns}
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable
+
+from database.dataclasses import Data
+
+logger = logging.getLogger(__name__)
+
+FlushCallback = Callable[
+    [dict[int, list[Data]]], Awaitable[tuple[dict[int, int], list[int]]]
+]
+
+
+class WriteBehindBuffer:
+    def __init__(
+        self,
+        flush: FlushCallback,
+        max_size: int,
+        batch_size: int,
+        max_delay: float,
+        put_timeout: float,
+    ) -> None:
+        self.flush = flush
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.put_timeout = put_timeout
+        self.task = None
+        self.closed = False
+        # Puts waiting for room in the queue. stop() lets them finish before
+        # queueing the sentinel, so no accepted reading lands behind it.
+        self.putting = 0
+        self.puts_done = asyncio.Event()
+
+        self.max_queue_depth = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.failed_rows = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    def start(self) -> None:
+        self.closed = False
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+        self.closed = True
+        # The flusher keeps making room, so waiting puts end within
+        # put_timeout at the latest.
+        while self.putting:
+            self.puts_done.clear()
+            await self.puts_done.wait()
+        # The sentinel goes behind everything already queued, so the flusher
+        # writes all pending readings before it exits.
+        await self.queue.put(None)
+        await self.task
+        self.task = None
+
+    async def put(self, device_id: int, data: Data) -> bool:
+        if self.closed:
+            return False
+        self.putting += 1
+        try:
+            await asyncio.wait_for(
+                self.queue.put((device_id, data)), timeout=self.put_timeout
+            )
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+        finally:
+            self.putting -= 1
+            if not self.putting:
+                self.puts_done.set()
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return True
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self.flush_batch(batch)
+
+        batch = []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not None:
+                batch.append(item)
+            if len(batch) >= self.batch_size:
+                await self.flush_batch(batch)
+                batch = []
+        if batch:
+            await self.flush_batch(batch)
+
+    async def flush_batch(self, batch: list[tuple[int, Data]]) -> None:
+        new_data = defaultdict(list)
+        for device_id, data in batch:
+            new_data[device_id].append(data)
+
+        start = time.perf_counter()
+        try:
+            counts, unknown_ids = await self.flush(new_data)
+        except Exception:
+            logger.exception("Failed to write %d buffered readings", len(batch))
+            self.failed_rows += len(batch)
+            return
+        finally:
+            latency = time.perf_counter() - start
+            self.flushes += 1
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            self.total_flush_latency += latency
+
+        self.flushed_rows += sum(counts.values())
+        if unknown_ids:
+            dropped = sum(len(new_data[device_id]) for device_id in unknown_ids)
+            logger.warning(
+                "Dropped %d buffered readings of unknown devices %s",
+                dropped,
+                unknown_ids,
+            )
+            self.failed_rows += dropped
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "max_queue_depth": self.max_queue_depth,
+            "rejected": self.rejected,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "failed_rows": self.failed_rows,
+            "last_flush_latency": self.last_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+            "avg_flush_latency": (
+                self.total_flush_latency / self.flushes if self.flushes else 0.0
+            ),
+        }
@@ -1,4 +1,10 @@
+import asyncio
 import random
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterator
+
+import numpy as np
+from database.dataclasses import Data
 
 
 class SomeDevice:
@@ -8,3 +14,108 @@ class SomeDevice:
         y = random.uniform(10, 100)
         z = random.uniform(10, 100)
         return (x, y, z)
+
+
+class ReadingsBatch:
+    def __init__(
+        self, device_ids: np.ndarray, dates: np.ndarray, values: np.ndarray
+    ) -> None:
+        # One row per reading, ordered by device and then by date.
+        self.device_ids = device_ids
+        self.dates = dates
+        self.values = values
+
+    def __len__(self) -> int:
+        return len(self.device_ids)
+
+    def to_data(self) -> dict[int, list[Data]]:
+        new_data = {}
+        dates = self.dates.astype(datetime).tolist()
+        values = self.values.tolist()
+        # Readings of a device are contiguous, so each one is a slice.
+        starts = np.flatnonzero(np.diff(self.device_ids, prepend=-1))
+        ends = np.append(starts[1:], len(self.device_ids))
+        for device_id, start, end in zip(
+            self.device_ids[starts].tolist(), starts.tolist(), ends.tolist()
+        ):
+            new_data[device_id] = [
+                Data(x, y, z, date, device_id)
+                for (x, y, z), date in zip(values[start:end], dates[start:end])
+            ]
+        return new_data
+
+
+class DeviceFleet:
+    # Readings of many devices generated together. Every device has its own
+    # x, y, z level that drifts as a random walk; readings add Gaussian noise
+    # to the level and arrive as a Poisson process with the given rate. A
+    # device is silent for a whole batch with gap_probability.
+    def __init__(
+        self,
+        device_ids: list[int],
+        rate: float = 1.0,
+        drift: float = 0.1,
+        noise: float = 1.0,
+        gap_probability: float = 0.0,
+        low: float = 10,
+        high: float = 100,
+        seed: int = None,
+        start: datetime = None,
+    ) -> None:
+        self.device_ids = np.asarray(device_ids, dtype=np.int64)
+        self.rate = rate
+        self.drift = drift
+        self.noise = noise
+        self.gap_probability = gap_probability
+        self.rng = np.random.default_rng(seed)
+        self.levels = self.rng.uniform(low, high, (len(self.device_ids), 3))
+        if start is None:
+            start = datetime.now(timezone.utc).replace(tzinfo=None)
+        self.now = np.datetime64(start, "us")
+
+    def batch(self, seconds: float) -> ReadingsBatch:
+        rng = self.rng
+        devices = len(self.device_ids)
+        counts = rng.poisson(self.rate * seconds, devices)
+        if self.gap_probability:
+            counts[rng.random(devices) < self.gap_probability] = 0
+        index = np.repeat(np.arange(devices), counts)
+        offsets = rng.uniform(0, seconds, len(index))
+        order = np.lexsort((offsets, index))
+        index = index[order]
+        offsets = offsets[order]
+
+        # The level moves linearly from its value at the start of the batch
+        # to the next step of the random walk at its end.
+        steps = rng.normal(0, self.drift * np.sqrt(seconds), (devices, 3))
+        fraction = (offsets / seconds)[:, None]
+        values = self.levels[index] + steps[index] * fraction
+        values += rng.normal(0, self.noise, values.shape)
+        self.levels += steps
+
+        dates = self.now + (offsets * 1e6).astype("timedelta64[us]")
+        self.now += np.timedelta64(int(seconds * 1e6), "us")
+        return ReadingsBatch(self.device_ids[index], dates, values)
+
+    def batches(self, seconds: float, rows: int) -> Iterator[ReadingsBatch]:
+        # Consecutive batches of the given length until about rows readings.
+        generated = 0
+        while generated < rows:
+            batch = self.batch(seconds)
+            generated += len(batch)
+            yield batch
+
+    async def stream(
+        self, interval: float = 1.0, realtime: bool = True
+    ) -> AsyncIterator[ReadingsBatch]:
+        # Endless batches of interval seconds each. In realtime mode a batch is
+        # yielded once the wall clock has reached its end, so the readings
+        # arrive at the configured rate.
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            batch = self.batch(interval)
+            if realtime:
+                deadline += interval
+                await asyncio.sleep(max(deadline - loop.time(), 0))
+            yield batch
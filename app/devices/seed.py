@@ -0,0 +1,95 @@
+import argparse
+import asyncio
+import time
+from datetime import timedelta
+
+from database.accessor import BaseAccessor
+from database.base import engine
+from database.partitions import utc_now
+from devices.device_simulator import DeviceFleet, ReadingsBatch
+
+# Fills the database with simulated readings through the same batch ingest
+# path as POST /device_data/batch (COPY plus catalog, rollup and sketch
+# upserts). Run from the app directory:
+#   python -m devices.seed --devices 1000 --rows 10000000
+# or stream readings in real time with --live SECONDS.
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Seed simulated device data.")
+    parser.add_argument("--login", default="seed")
+    parser.add_argument("--password", default="seed")
+    parser.add_argument("--first-device-id", type=int, default=1)
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch-rows", type=int, default=50_000)
+    parser.add_argument("--rate", type=float, default=1.0, help="readings/s/device")
+    parser.add_argument("--drift", type=float, default=0.1)
+    parser.add_argument("--noise", type=float, default=1.0)
+    parser.add_argument("--gap-probability", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--live",
+        type=float,
+        default=None,
+        help="stream readings in real time for this many seconds instead",
+    )
+    parser.add_argument("--interval", type=float, default=1.0)
+    return parser.parse_args()
+
+
+async def prepare_devices(db: BaseAccessor, args: argparse.Namespace) -> list[int]:
+    user = await db.add_user(args.login, args.password)
+    if not user:
+        user = await db.get_user(login=args.login, with_devices=False)
+    device_ids = list(range(args.first_device_id, args.first_device_id + args.devices))
+    for device_id in device_ids:
+        await db.add_device(device_id, user.id)
+    return device_ids
+
+
+async def ingest(db: BaseAccessor, batch: ReadingsBatch) -> int:
+    if not len(batch):
+        return 0
+    counts, unknown_ids = await db.new_data_batch(batch.to_data())
+    if unknown_ids:
+        print(f"Unknown devices skipped: {unknown_ids}")
+    return sum(counts.values())
+
+
+async def seed(args: argparse.Namespace) -> None:
+    db = BaseAccessor()
+    device_ids = await prepare_devices(db, args)
+    readings_per_second = args.rate * len(device_ids)
+    fleet_args = dict(
+        device_ids=device_ids,
+        rate=args.rate,
+        drift=args.drift,
+        noise=args.noise,
+        gap_probability=args.gap_probability,
+        seed=args.seed,
+    )
+    started = time.perf_counter()
+    stored = 0
+    if args.live is None:
+        # History that ends now, at the requested rate.
+        now = utc_now()
+        start = now - timedelta(seconds=args.rows / readings_per_second)
+        fleet = DeviceFleet(start=start, **fleet_args)
+        for batch in fleet.batches(args.batch_rows / readings_per_second, args.rows):
+            stored += await ingest(db, batch)
+            elapsed = time.perf_counter() - started
+            print(f"{stored} rows, {stored / elapsed:.0f} rows/s")
+    else:
+        fleet = DeviceFleet(**fleet_args)
+        async for batch in fleet.stream(args.interval):
+            stored += await ingest(db, batch)
+            if time.perf_counter() - started >= args.live:
+                break
+        elapsed = time.perf_counter() - started
+        print(f"{stored} rows in {elapsed:.1f} s")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(seed(parse_args()))
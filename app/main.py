@@ -1,19 +1,104 @@
 import asyncio
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Annotated
+from typing import Annotated, AsyncIterator, Literal
 
+import metrics
 import uvicorn
+from config import DEVICES_PAGE_MAX_LIMIT, PUBSUB_HEARTBEAT
 from database.accessor import BaseAccessor
-from database.base import init_models
-from fastapi import Depends, FastAPI, Response, status
+from database.archive import ArchivedRange
+from database.base import engine, init_models
+from database.dataclasses import Analysis, Data, RollingWindow
+from database.pubsub import Subscription
+from database.rolling import TooManyWindows
+from database.series import TooManyReadings
+from fastapi import (
+    Depends,
+    FastAPI,
+    Query,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from web.schemas import DataSchema, DeviceSchema, UserSchema
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from web.schemas import DataSchema, DeviceDataBatchSchema, DeviceSchema, UserSchema
+from web.streaming import (
+    CSV_MEDIA_TYPE,
+    NDJSON_MEDIA_TYPE,
+    SSE_MEDIA_TYPE,
+    csv_rows,
+    ndjson,
+    sse_event,
+)
 
-app = FastAPI()
 db = BaseAccessor()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await db.start()
+    yield
+    await db.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 
+class MetricsMiddleware:
+    # A plain ASGI middleware: it neither wraps the response body, which
+    # streaming and SSE responses would pay for, nor matches routes itself,
+    # since the router has put the matched route into the scope by the time
+    # the response starts.
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        started = False
+
+        def record(status_code: int) -> None:
+            route = scope.get("route")
+            labels = (scope["method"], route.path if route else "unmatched")
+            metrics.http_latency.observe(labels, time.perf_counter() - start)
+            if status_code >= 500:
+                metrics.http_errors.inc(labels)
+            metrics.http_requests.inc(labels + (str(status_code),))
+
+        async def send_recorded(message: Message) -> None:
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_recorded)
+        except Exception:
+            if not started:
+                record(500)
+            raise
+
+
+app.add_middleware(MetricsMiddleware)
+
+
+@app.get("/metrics")
+async def metrics_text():
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.get("/")
 async def root():
     hi_message = (
@@ -22,6 +107,26 @@ async def root():
     return Response(content=hi_message)
 
 
+@app.get("/health/live")
+async def health_live():
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+async def health_ready():
+    if not db.ready:
+        return JSONResponse(
+            content={"status": "not ready"},
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+    if not await db.ping():
+        return JSONResponse(
+            content={"status": "database unavailable"},
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+    return {"status": "ok"}
+
+
 @app.post("/add_user/")
 async def add_user(user_info: UserSchema):
     user = await db.add_user(user_info.login, user_info.password)
@@ -75,45 +180,379 @@ async def add_device(
 
 
 @app.get("/devices/")
-async def get_all_devices():
-    devices = await db.get_devices()
-    if devices is None:
+async def get_all_devices(
+    after_id: Annotated[int, Query(ge=0)] = None,
+    limit: Annotated[int, Query(ge=1, le=DEVICES_PAGE_MAX_LIMIT)] = None,
+    stream: bool = False,
+):
+    if stream:
+        chunks = (
+            [{"id": device_id} for device_id in device_ids]
+            async for device_ids in db.stream_device_ids()
+        )
+        return StreamingResponse(ndjson(chunks), media_type=NDJSON_MEDIA_TYPE)
+
+    list_id = await db.get_device_ids(after_id, limit)
+    if not list_id and after_id is None:
         return Response(
             content="No devices found.",
             status_code=status.HTTP_404_NOT_FOUND,
         )
-    list_id = [device.id for device in devices]
     response = {"device_ids": list_id}
+    if limit and len(list_id) == limit:
+        response["next_after_id"] = list_id[-1]
     return response
 
 
 @app.get("/new_device_data/{id}", response_model=DataSchema)
 async def new_device_data(id: int):
-    device = await db.get_device(id)
-    if device is None:
+    if not await db.device_exists(id):
         return Response(
             content=f"Device with id = {id} not found!",
             status_code=status.HTTP_400_BAD_REQUEST,
         )
     data = await db.new_data(id)
+    if data is None:
+        return Response(
+            content="Ingest queue is full, try again later.",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
     response = {"x": data.x, "y": data.y, "z": data.z, "date": data.date}
     return response
 
 
-@app.get("/device_data_analysis/")
-async def device_data_analysis(
-    device_id: int = None,
-    user_id: int = None,
+@app.post("/device_data/batch")
+async def device_data_batch(batch: DeviceDataBatchSchema):
+    new_data = defaultdict(list)
+    for row in batch.data:
+        new_data[row.device_id].append(Data(x=row.x, y=row.y, z=row.z, date=row.date))
+    counts, unknown_ids = await db.new_data_batch(new_data)
+    response = {
+        "inserted": sum(counts.values()),
+        "rejected": sum(len(new_data[device_id]) for device_id in unknown_ids),
+        "devices": counts,
+        "unknown_device_ids": unknown_ids,
+    }
+    if not counts and unknown_ids:
+        return JSONResponse(content=response, status_code=status.HTTP_400_BAD_REQUEST)
+    return response
+
+
+EXPORT_FIELDS = ["device_id", "date", "x", "y", "z"]
+
+
+def reading_row(device_id: int, data: Data) -> dict:
+    return {
+        "device_id": device_id,
+        "date": data.date.isoformat(),
+        "x": data.x,
+        "y": data.y,
+        "z": data.z,
+    }
+
+
+def export_response(
+    chunks: AsyncIterator[list[Data]], export_format: str, filename: str
+) -> StreamingResponse:
+    rows = ([reading_row(d.device_id, d) for d in data] async for data in chunks)
+    if export_format == "csv":
+        content = csv_rows(rows, EXPORT_FIELDS)
+        media_type = CSV_MEDIA_TYPE
+    else:
+        content = ndjson(rows)
+        media_type = NDJSON_MEDIA_TYPE
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}.{export_format}"'
+    }
+    return StreamingResponse(content, media_type=media_type, headers=headers)
+
+
+def archived_response(error: ArchivedRange) -> Response:
+    return Response(
+        content=(
+            "The range reaches archived readings, which only "
+            f"/device_data_analysis includes; use begin >= {error.until.isoformat()}."
+        ),
+        status_code=status.HTTP_400_BAD_REQUEST,
+    )
+
+
+@app.get("/device_data/{id}/export")
+async def export_device_data(
+    id: int,
+    begin: datetime = None,
+    end: datetime = None,
+    export_format: Annotated[
+        Literal["ndjson", "csv"], Query(alias="format")
+    ] = "ndjson",
+):
+    if not await db.device_exists(id):
+        return Response(
+            content=f"Device with id = {id} not found!",
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+    try:
+        await db.check_archive(begin, end, device_id=id)
+    except ArchivedRange as error:
+        return archived_response(error)
+    chunks = db.stream_data(device_id=id, begin=begin, end=end)
+    return export_response(chunks, export_format, f"device_{id}")
+
+
+@app.get("/device_data/{id}/series")
+async def device_data_series(
+    id: int,
     column: str = None,
     begin: datetime = datetime(1753, 1, 1, 0, 0, 0),
     end: datetime = datetime(9999, 12, 31, 23, 59, 59),
+    points: Annotated[int, Query(ge=3, le=10000)] = 500,
+    method: Literal["bucket", "lttb"] = "bucket",
 ):
-    analysis = await db.get_analysis(device_id, user_id, column, begin, end)
-    if not analysis:
+    try:
+        series = await db.get_series(id, column, begin, end, points, method)
+    except TooManyReadings:
+        return Response(
+            content="Too many readings for LTTB, use method=bucket.",
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    except ArchivedRange as error:
+        return archived_response(error)
+    if series is None:
         return Response(content="No data yet.")
+    response = {
+        column: [{"date": date, "value": value} for date, value in column_points]
+        for column, column_points in series.items()
+    }
+    return {id: response}
+
+
+@app.get("/user_data/{id}/export")
+async def export_user_data(
+    id: int,
+    begin: datetime = None,
+    end: datetime = None,
+    export_format: Annotated[
+        Literal["ndjson", "csv"], Query(alias="format")
+    ] = "ndjson",
+):
+    user = await db.get_user(id=id, with_devices=False)
+    if not user:
+        return Response(
+            content=f"User with id = {id} not found!",
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+    try:
+        await db.check_archive(begin, end, user_id=id)
+    except ArchivedRange as error:
+        return archived_response(error)
+    chunks = db.stream_data(user_id=id, begin=begin, end=end)
+    return export_response(chunks, export_format, f"user_{id}")
+
+
+def rolling_response(windows: dict[str, list[RollingWindow]]) -> dict:
+    return {
+        column: [
+            {
+                "date": window.date,
+                "count": window.count,
+                "mean": window.mean,
+                "stddev": window.stddev,
+                "min_value": window.min_value,
+                "max_value": window.max_value,
+            }
+            for window in column_windows
+        ]
+        for column, column_windows in windows.items()
+    }
+
+
+async def rolling(
+    device_id: int,
+    user_id: int,
+    column: str,
+    begin: datetime,
+    end: datetime,
+    window: float,
+    step: float,
+    unit: str,
+) -> Response:
+    try:
+        windows = await db.get_rolling(
+            device_id, user_id, column, begin, end, window, step, unit
+        )
+    except TooManyWindows:
+        return Response(
+            content="Too many windows, increase step or narrow the range.",
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    except ArchivedRange as error:
+        return archived_response(error)
+    if windows is None:
+        return Response(content="No data yet.")
+    return {device_id or user_id: rolling_response(windows)}
+
+
+@app.get("/device_data/{id}/rolling")
+async def device_data_rolling(
+    id: int,
+    column: str = None,
+    begin: datetime = datetime(1753, 1, 1, 0, 0, 0),
+    end: datetime = datetime(9999, 12, 31, 23, 59, 59),
+    window: Annotated[float, Query(gt=0)] = 60,
+    step: Annotated[float, Query(gt=0)] = None,
+    unit: Literal["seconds", "rows"] = "seconds",
+):
+    return await rolling(id, None, column, begin, end, window, step, unit)
+
+
+@app.get("/user_data/{id}/rolling")
+async def user_data_rolling(
+    id: int,
+    column: str = None,
+    begin: datetime = datetime(1753, 1, 1, 0, 0, 0),
+    end: datetime = datetime(9999, 12, 31, 23, 59, 59),
+    window: Annotated[float, Query(gt=0)] = 60,
+    step: Annotated[float, Query(gt=0)] = None,
+    unit: Literal["seconds", "rows"] = "seconds",
+):
+    return await rolling(None, id, column, begin, end, window, step, unit)
+
+
+async def wait_disconnect(websocket: WebSocket, subscription: Subscription):
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+    subscription.close()
+
+
+async def live_websocket(websocket: WebSocket, kind: str, id: int):
+    subscription = db.pubsub.subscribe(kind, id)
+    if subscription is None:
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+    await websocket.accept()
+    receiver = asyncio.create_task(wait_disconnect(websocket, subscription))
+    try:
+        while True:
+            readings = await subscription.get()
+            if not readings and subscription.closed:
+                break
+            for device_id, data in readings:
+                await websocket.send_json(reading_row(device_id, data))
+        if subscription.dropped:
+            await websocket.close(
+                code=status.WS_1008_POLICY_VIOLATION,
+                reason="Subscriber is too slow, readings were dropped.",
+            )
+        elif not receiver.done():
+            await websocket.close(code=status.WS_1001_GOING_AWAY)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        receiver.cancel()
+        db.pubsub.unsubscribe(subscription)
+
+
+async def live_events(subscription: Subscription) -> AsyncIterator[str]:
+    try:
+        while True:
+            readings = await subscription.get(timeout=PUBSUB_HEARTBEAT)
+            if readings:
+                yield "".join(
+                    sse_event(reading_row(device_id, data))
+                    for device_id, data in readings
+                )
+            elif subscription.closed:
+                break
+            else:
+                yield ": keepalive\n\n"
+        if subscription.dropped:
+            yield sse_event(
+                {"detail": "Subscriber is too slow, readings were dropped."},
+                event="dropped",
+            )
+    finally:
+        db.pubsub.unsubscribe(subscription)
+
+
+def live_events_response(kind: str, id: int) -> Response:
+    subscription = db.pubsub.subscribe(kind, id)
+    if subscription is None:
+        return Response(
+            content="Too many subscribers.",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+    return StreamingResponse(
+        live_events(subscription),
+        media_type=SSE_MEDIA_TYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.websocket("/device_data/{id}/live")
+async def device_data_live(websocket: WebSocket, id: int):
+    if not await db.device_exists(id):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await live_websocket(websocket, "device", id)
+
+
+@app.websocket("/user_data/{id}/live")
+async def user_data_live(websocket: WebSocket, id: int):
+    if not await db.get_user(id=id, with_devices=False):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await live_websocket(websocket, "user", id)
+
+
+@app.get("/device_data/{id}/events")
+async def device_data_events(id: int):
+    if not await db.device_exists(id):
+        return Response(
+            content=f"Device with id = {id} not found!",
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+    return live_events_response("device", id)
+
+
+@app.get("/user_data/{id}/events")
+async def user_data_events(id: int):
+    if not await db.get_user(id=id, with_devices=False):
+        return Response(
+            content=f"User with id = {id} not found!",
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+    return live_events_response("user", id)
+
+
+@app.get("/live/stats")
+async def live_stats():
+    return db.pubsub.stats()
+
+
+@app.get("/ingest/stats")
+async def ingest_stats():
+    if not db.write_behind:
+        return Response(
+            content="Write-behind ingest is disabled.",
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+    return db.write_behind.stats()
+
+
+@app.get("/db/pool")
+async def db_pool_stats():
+    return engine.pool.stats()
+
+
+@app.get("/device_data_analysis/cache")
+async def analysis_cache_stats():
+    return db.analysis_cache.stats()
+
+
+def analysis_response(analysis: list[Analysis]) -> dict:
     response = dict()
     for column_analysis in analysis:
-        response[column_analysis.column] = {
+        column_response = {
             "begin_date": column_analysis.begin_date,
             "end_date": column_analysis.end_date,
             "min_value": column_analysis.min_value,
@@ -122,6 +561,25 @@ async def device_data_analysis(
             "sum": column_analysis.sum,
             "median": column_analysis.median,
         }
+        if column_analysis.median_error is not None:
+            column_response["median_relative_error"] = column_analysis.median_error
+        response[column_analysis.column] = column_response
+    return response
+
+
+@app.get("/device_data_analysis/")
+async def device_data_analysis(
+    device_id: int = None,
+    user_id: int = None,
+    column: str = None,
+    begin: datetime = datetime(1753, 1, 1, 0, 0, 0),
+    end: datetime = datetime(9999, 12, 31, 23, 59, 59),
+    approx: bool = False,
+):
+    analysis = await db.get_analysis(device_id, user_id, column, begin, end, approx)
+    if not analysis:
+        return Response(content="No data yet.")
+    response = analysis_response(analysis)
     if device_id:
         response = {device_id: response}
     elif user_id:
@@ -129,6 +587,34 @@ async def device_data_analysis(
     return response
 
 
+@app.get("/device_data_analysis/devices")
+async def devices_data_analysis(
+    device_ids: Annotated[list[int], Query()] = None,
+    user_id: int = None,
+    column: str = None,
+    begin: datetime = datetime(1753, 1, 1, 0, 0, 0),
+    end: datetime = datetime(9999, 12, 31, 23, 59, 59),
+):
+    if not device_ids and not user_id:
+        return Response(
+            content="Specify device_ids or user_id.",
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    try:
+        analysis = await db.get_devices_analysis(
+            device_ids, user_id, column, begin, end
+        )
+    except ArchivedRange as error:
+        return archived_response(error)
+    if not analysis:
+        return Response(content="No data yet.")
+    response = {
+        device_id: analysis_response(device_analysis)
+        for device_id, device_analysis in analysis.items()
+    }
+    return response
+
+
 if __name__ == "__main__":
     loop = asyncio.get_event_loop()
     loop.run_until_complete(init_models())
@@ -0,0 +1,183 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from inspect import isasyncgenfunction, iscoroutinefunction
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Name of the accessor method whose statements are being executed. SQLAlchemy
+# runs the driver calls in a greenlet sharing the task's context, so the cursor
+# events below see the value set by the awaiting coroutine.
+query_method: ContextVar[str] = ContextVar("query_method", default="other")
+
+
+def label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def labels_text(labelnames: tuple, labels: tuple, extra: str = "") -> str:
+    pairs = [
+        f'{name}="{label_value(value)}"' for name, value in zip(labelnames, labels)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{labels_text(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self.values = {}
+
+    def observe(self, labels: tuple, value: float):
+        counts_sum = self.values.get(labels)
+        if counts_sum is None:
+            counts_sum = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        counts_sum[0][bisect_left(self.buckets, value)] += 1
+        counts_sum[1] += value
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = labels_text(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            text = labels_text(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{text} {total}")
+            lines.append(f"{self.name}_count{text} {cumulative}")
+        return lines
+
+
+http_requests = Counter(
+    "http_requests_total",
+    "HTTP requests by route and status code.",
+    ("method", "route", "status"),
+)
+http_errors = Counter(
+    "http_request_errors_total",
+    "HTTP requests that failed with a server error or an unhandled exception.",
+    ("method", "route"),
+)
+http_latency = Histogram(
+    "http_request_duration_seconds",
+    "Time until the response start, by route.",
+    ("method", "route"),
+)
+db_query_latency = Histogram(
+    "db_query_duration_seconds",
+    "SQL statement execution time, by accessor method.",
+    ("method",),
+)
+db_query_errors = Counter(
+    "db_query_errors_total",
+    "Failed SQL statements, by accessor method.",
+    ("method",),
+)
+METRICS = [http_requests, http_errors, http_latency, db_query_latency, db_query_errors]
+
+
+def render() -> str:
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+def labelled(name: str, func):
+    if isasyncgenfunction(func):
+
+        @wraps(func)
+        async def generator_wrapper(*args, **kwargs):
+            iterator = func(*args, **kwargs)
+            try:
+                while True:
+                    token = query_method.set(name)
+                    try:
+                        item = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    finally:
+                        query_method.reset(token)
+                    yield item
+            finally:
+                await iterator.aclose()
+
+        return generator_wrapper
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = query_method.set(name)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            query_method.reset(token)
+
+    return wrapper
+
+
+def label_queries(cls):
+    for name, func in list(vars(cls).items()):
+        if name.startswith("_"):
+            continue
+        if iscoroutinefunction(func) or isasyncgenfunction(func):
+            setattr(cls, name, labelled(name, func))
+    return cls
+
+
+def instrument_engine(engine: Engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        start = conn.info["query_start"].pop()
+        db_query_latency.observe((query_method.get(),), time.perf_counter() - start)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        starts = (
+            context.connection.info.get("query_start") if context.connection else None
+        )
+        if starts:
+            starts.pop()
+        db_query_errors.inc((query_method.get(),))
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+from types import FrameType
+
+import uvicorn
+from config import (
+    DB_SCHEMA_SETUP,
+    HOT_WINDOW_ENABLED,
+    SERVER_DRAIN_DELAY,
+    SERVER_GRACEFUL_TIMEOUT,
+    SERVER_HOST,
+    SERVER_PORT,
+    SERVER_WORKERS,
+)
+from uvicorn.main import STARTUP_FAILURE
+from uvicorn.supervisors import Multiprocess
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger("serve")
+
+
+# The revision matching the tables that init_models() used to create on
+# startup, before the schema was managed by migrations.
+INITIAL_REVISION = "2b1e5c64febc"
+INITIAL_TABLES = {"users", "devices", "data"}
+# The first table a later revision added.
+SECOND_REVISION_TABLE = "device_periods"
+# The revision before the rollups and sketches were partitioned, for the
+# current tables without the default partitions that revision adds.
+UNPARTITIONED_SUMMARIES_REVISION = "d2c5a8f3e17b"
+
+
+def alembic(*args: str) -> None:
+    # A separate process keeps alembic's logging config and engine out of
+    # the server process.
+    subprocess.run([sys.executable, "-m", "alembic", *args], cwd=APP_DIR, check=True)
+
+
+def unversioned_revision() -> str:
+    # Revision to stamp a database created by create_all without migrations,
+    # None if alembic already tracks it or it is empty.
+    from database.base import engine
+    from database.models import Base
+    from sqlalchemy import inspect
+
+    async def table_names() -> set[str]:
+        async with engine.connect() as connection:
+            names = await connection.run_sync(
+                lambda sync_connection: inspect(sync_connection).get_table_names()
+            )
+        await engine.dispose()
+        return set(names)
+
+    tables = asyncio.run(table_names())
+    if "alembic_version" in tables or not tables & INITIAL_TABLES:
+        return None
+    if set(Base.metadata.tables) <= tables:
+        if "data_sketches_default" not in tables:
+            return UNPARTITIONED_SUMMARIES_REVISION
+        return "head"
+    if INITIAL_TABLES <= tables and SECOND_REVISION_TABLE not in tables:
+        return INITIAL_REVISION
+    raise RuntimeError(
+        "The database has tables but no alembic_version and matches neither "
+        "the initial schema nor the current one; stamp its revision with "
+        "'alembic stamp <revision>' before starting the service."
+    )
+
+
+def setup_schema() -> None:
+    if DB_SCHEMA_SETUP == "alembic":
+        revision = unversioned_revision()
+        if revision:
+            logger.info("Stamping unversioned database as %s", revision)
+            alembic("stamp", revision)
+        alembic("upgrade", "head")
+    elif DB_SCHEMA_SETUP == "create_all":
+        from database.base import engine, init_models
+
+        # The models register their tables with Base when imported.
+        import database.models  # noqa: F401
+
+        async def create_all():
+            await init_models()
+            await engine.dispose()
+
+        asyncio.run(create_all())
+    elif DB_SCHEMA_SETUP != "none":
+        raise ValueError(f"Unknown DB_SCHEMA_SETUP: {DB_SCHEMA_SETUP}")
+
+
+class DrainingServer(uvicorn.Server):
+    # Readiness turns false as soon as a shutdown signal arrives, before
+    # uvicorn closes the listening socket and waits out the graceful timeout.
+    # With SERVER_DRAIN_DELAY the worker keeps serving that long first, so
+    # load balancers see the failing probe before connections are refused.
+    draining = False
+
+    def handle_exit(self, sig: int, frame: FrameType) -> None:
+        # uvicorn has imported the app in this process before it installs
+        # the signal handlers.
+        from main import db
+
+        db.ready = False
+        if SERVER_DRAIN_DELAY and not self.draining:
+            self.draining = True
+            asyncio.get_running_loop().call_later(
+                SERVER_DRAIN_DELAY, super().handle_exit, sig, frame
+            )
+            return
+        super().handle_exit(sig, frame)
+
+
+class DrainingMultiprocess(Multiprocess):
+    def shutdown(self) -> None:
+        # Signals every worker before waiting for any, so that they all turn
+        # unready and drain at the same time instead of one after another.
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    if HOT_WINDOW_ENABLED and SERVER_WORKERS > 1:
+        logger.error(
+            "HOT_WINDOW_ENABLED needs SERVER_WORKERS=1, not %d: each worker "
+            "only caches its own readings, so recent-window analysis would "
+            "miss the others'.",
+            SERVER_WORKERS,
+        )
+        sys.exit(STARTUP_FAILURE)
+    if SERVER_WORKERS > 1:
+        logger.warning(
+            "%d workers: live subscriptions (/live, /events) only receive the "
+            "readings ingested by the worker that serves them.",
+            SERVER_WORKERS,
+        )
+    setup_schema()
+    config = uvicorn.Config(
+        "main:app",
+        host=SERVER_HOST,
+        port=SERVER_PORT,
+        workers=SERVER_WORKERS,
+        loop="uvloop",
+        http="httptools",
+        timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT,
+        proxy_headers=True,
+    )
+    server = DrainingServer(config)
+    if config.workers > 1:
+        sock = config.bind_socket()
+        DrainingMultiprocess(config, target=server.run, sockets=[sock]).run()
+    else:
+        server.run()
+        if not server.started:
+            sys.exit(STARTUP_FAILURE)
+
+
+if __name__ == "__main__":
+    main()
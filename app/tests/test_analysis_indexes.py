@@ -0,0 +1,101 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+# Checks that the covering indexes of c4f81a09d2b7 answer the analysis
+# queries with index-only scans, as the planner picks them on its own.
+# TEST_DATABASE_URL must point to a Postgres database used only for tests:
+# its tables are dropped and recreated. Run from the app directory:
+#   TEST_DATABASE_URL=... python -m pytest tests
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+if not TEST_DATABASE_URL:
+    pytest.skip("TEST_DATABASE_URL is not set", allow_module_level=True)
+# The app modules build their engine on import; it is never connected here.
+os.environ.setdefault("DATABASE_URL", TEST_DATABASE_URL)
+
+from database.accessor import Data_Analyst
+from database.models import Base
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+BEGIN = datetime(2024, 1, 1)
+# A reading per minute for a week from 50 devices, two of them of user 1.
+DEVICES = 50
+USER_DEVICES = 2
+READINGS = 7 * 24 * 60
+# One hour in the middle of the week: a small share of the table, as an
+# analysis request usually is.
+WINDOW_BEGIN = BEGIN + timedelta(days=3)
+WINDOW_END = WINDOW_BEGIN + timedelta(hours=1)
+COLUMNS = ["x", "y", "z"]
+
+CASES = {
+    "device": {"device_id": 1},
+    "user": {"user_id": 1},
+    "all": {},
+}
+
+
+async def explain_analysis() -> dict[str, str]:
+    engine = create_async_engine(TEST_DATABASE_URL, poolclass=NullPool)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+        await connection.execute(
+            text("INSERT INTO users (id, login) VALUES (1, 'explain'), (2, 'other')")
+        )
+        await connection.execute(
+            text(
+                "INSERT INTO devices (id, user_id) "
+                "SELECT d, CASE WHEN d <= :user_devices THEN 1 ELSE 2 END "
+                "FROM generate_series(1, :devices) AS d"
+            ),
+            {"devices": DEVICES, "user_devices": USER_DEVICES},
+        )
+        await connection.execute(
+            text(
+                "INSERT INTO data (device_id, date, x, y, z) "
+                "SELECT d, CAST(:begin AS timestamp) + make_interval(mins => i), "
+                "random(), random() - 0.5, random() * 10 "
+                "FROM generate_series(1, :devices) AS d, "
+                "generate_series(0, :readings - 1) AS i"
+            ),
+            {"begin": BEGIN, "devices": DEVICES, "readings": READINGS},
+        )
+    # Index-only scans need the visibility map that VACUUM sets, and VACUUM
+    # cannot run inside a transaction.
+    async with engine.connect() as connection:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        await connection.execute(text("VACUUM ANALYZE data"))
+        await connection.execute(text("VACUUM ANALYZE devices"))
+
+    plans = {}
+    async with engine.connect() as connection:
+        for name, ids in CASES.items():
+            analyst = Data_Analyst(COLUMNS, WINDOW_BEGIN, WINDOW_END, **ids)
+            stmt = analyst.statement(analyst.select_args())
+            sql = stmt.compile(
+                engine.sync_engine, compile_kwargs={"literal_binds": True}
+            )
+            result = await connection.exec_driver_sql(f"EXPLAIN {sql}")
+            plans[name] = "\n".join(row[0] for row in result)
+
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+    await engine.dispose()
+    return plans
+
+
+@pytest.fixture(scope="module")
+def plans() -> dict[str, str]:
+    return asyncio.run(explain_analysis())
+
+
+@pytest.mark.parametrize("name", CASES)
+def test_analysis_uses_index_only_scan(plans: dict[str, str], name: str) -> None:
+    plan = plans[name]
+    assert "Index Only Scan" in plan, plan
+    assert "Seq Scan on data" not in plan, plan
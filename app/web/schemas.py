@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from datetime import datetime
+from pydantic import BaseModel, field_validator
+from datetime import datetime, timezone
 
 
 class UserSchema(BaseModel):
@@ -18,6 +18,25 @@ class DataSchema(BaseModel):
     date: datetime
 
 
+class DeviceDataSchema(BaseModel):
+    device_id: int
+    x: float
+    y: float
+    z: float
+    date: datetime
+
+    @field_validator("date")
+    @classmethod
+    def naive_utc(cls, date: datetime) -> datetime:
+        if date.tzinfo is not None:
+            date = date.astimezone(timezone.utc).replace(tzinfo=None)
+        return date
+
+
+class DeviceDataBatchSchema(BaseModel):
+    data: list[DeviceDataSchema]
+
+
 class AnalysisSchema(BaseModel):
     column: str
     begin_date: datetime
@@ -0,0 +1,33 @@
+import csv
+import io
+import json
+from typing import AsyncIterator
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+CSV_MEDIA_TYPE = "text/csv"
+SSE_MEDIA_TYPE = "text/event-stream"
+
+
+async def ndjson(chunks: AsyncIterator[list[dict]]) -> AsyncIterator[str]:
+    async for rows in chunks:
+        yield "".join(json.dumps(row, default=str) + "\n" for row in rows)
+
+
+async def csv_rows(
+    chunks: AsyncIterator[list[dict]], fieldnames: list[str]
+) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+    writer.writeheader()
+    async for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def sse_event(data: dict, event: str = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, default=str)}\n\n"
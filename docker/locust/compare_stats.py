@@ -0,0 +1,95 @@
+import argparse
+import csv
+import sys
+
+# Compares the *_stats.csv files of two headless locust runs of the same
+# profile and exits with status 1 on regressions:
+#   python compare_stats.py results/mixed-v1-base_stats.csv \
+#       results/mixed-v1-new_stats.csv --threshold 0.2
+
+
+def load(path: str) -> dict:
+    with open(path, newline="") as file:
+        return {(row["Type"], row["Name"]): row for row in csv.DictReader(file)}
+
+
+def number(row: dict, column: str) -> float:
+    value = row.get(column)
+    if value in (None, "", "N/A"):
+        return 0.0
+    return float(value)
+
+
+def failure_ratio(row: dict) -> float:
+    requests = number(row, "Request Count")
+    return number(row, "Failure Count") / requests if requests else 0.0
+
+
+def compare(
+    base: dict, new: dict, percentile: str, threshold: float, max_failures: float
+) -> list[str]:
+    regressions = []
+    print(
+        f"{'request':52} {'base':>8} {'new':>8} {'change':>8}"
+        f" {'rps base':>9} {'rps new':>9} {'fail':>6}"
+    )
+    for key, base_row in base.items():
+        new_row = new.get(key)
+        name = " ".join(part for part in key if part)
+        if new_row is None:
+            print(f"{name:52} missing in the new run")
+            continue
+        base_value = number(base_row, percentile)
+        new_value = number(new_row, percentile)
+        change = new_value / base_value - 1 if base_value else 0.0
+        base_rps = number(base_row, "Requests/s")
+        new_rps = number(new_row, "Requests/s")
+        failures = failure_ratio(new_row)
+        flags = []
+        if change > threshold:
+            flags.append(f"{percentile} +{change:.0%}")
+        if base_rps and new_rps < base_rps * (1 - threshold):
+            flags.append(f"requests/s {base_rps:.1f} -> {new_rps:.1f}")
+        if failures > max(failure_ratio(base_row), max_failures):
+            flags.append(f"failures {failures:.1%}")
+        print(
+            f"{name:52} {base_value:8.0f} {new_value:8.0f} {change:+8.1%}"
+            f" {base_rps:9.1f} {new_rps:9.1f} {failures:6.1%}"
+            f"{'  REGRESSION' if flags else ''}"
+        )
+        if flags:
+            regressions.append(f"{name}: {', '.join(flags)}")
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare locust CSV stats.")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument(
+        "--percentile", default="95%", help="response time column, e.g. 50%%, 99%%"
+    )
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument(
+        "--max-failures",
+        type=float,
+        default=0.01,
+        help="allowed failure ratio of a request in the new run",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    regressions = compare(
+        load(args.base),
+        load(args.new),
+        args.percentile,
+        args.threshold,
+        args.max_failures,
+    )
+    if regressions:
+        print("\nRegressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
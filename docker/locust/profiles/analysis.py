@@ -0,0 +1,79 @@
+import os
+import random
+
+from common import DeviceIds, ProfileUser, id_range
+from locust import task
+
+# Profile v1: read-only analysis load against a pre-seeded dataset, e.g. one
+# filled by
+#   python -m devices.seed --devices 1000 --rows 10000000 --rate 0.016
+# 10^4 readings per device at 0.016/s span about 7.2 days, so the windows
+# drawn from the last WINDOW_HISTORY_DAYS (7) all have readings; at the
+# default rate of 1/s the same rows span under 3 hours. Users are not
+# registered; user analysis picks ids from LOCUST_USER_IDS ("first-last").
+USER_IDS = id_range(os.environ.get("LOCUST_USER_IDS", "1-10"))
+
+
+class AnalysisUser(ProfileUser):
+    @task(30)
+    def device_analysis(self):
+        self.client.get(
+            "/device_data_analysis/",
+            params={"device_id": self.random_device_id()},
+            name="/device_data_analysis/?device_id",
+        )
+
+    @task(20)
+    def device_window_analysis(self):
+        params = {
+            "device_id": self.random_device_id(),
+            **self.random_window(random.choice([1, 6, 24])),
+        }
+        self.client.get(
+            "/device_data_analysis/",
+            params=params,
+            name="/device_data_analysis/?device_id&window",
+        )
+
+    @task(10)
+    def device_approx_analysis(self):
+        self.client.get(
+            "/device_data_analysis/",
+            params={"device_id": self.random_device_id(), "approx": "true"},
+            name="/device_data_analysis/?device_id&approx",
+        )
+
+    @task(10)
+    def user_analysis(self):
+        self.client.get(
+            "/device_data_analysis/",
+            params={"user_id": random.choice(USER_IDS)},
+            name="/device_data_analysis/?user_id",
+        )
+
+    @task(5)
+    def devices_analysis(self):
+        device_ids = DeviceIds.get(self.client)
+        device_ids = random.sample(device_ids, min(10, len(device_ids)))
+        self.client.get(
+            "/device_data_analysis/devices",
+            params={"device_ids": device_ids},
+            name="/device_data_analysis/devices",
+        )
+
+    @task(2)
+    def all_analysis(self):
+        self.client.get(
+            "/device_data_analysis/",
+            params={"approx": "true"},
+            name="/device_data_analysis/?approx",
+        )
+
+    @task(20)
+    def device_series(self):
+        params = self.random_window(24)
+        self.client.get(
+            f"/device_data/{self.random_device_id()}/series",
+            params=params,
+            name="/device_data/[id]/series",
+        )
@@ -0,0 +1,109 @@
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+from gevent.lock import Semaphore
+from locust import HttpUser, between
+
+# Shared by the headless profiles in this directory. Device ids are loaded
+# once per locust process and refreshed rarely, instead of calling /devices
+# before every task.
+DEVICE_IDS_REFRESH = float(os.environ.get("LOCUST_DEVICE_IDS_REFRESH", 300))
+DEVICE_IDS_PAGE = 10000
+# Analysis windows are drawn from this many days before now. A pre-seeded
+# dataset has to cover them, see analysis.py.
+WINDOW_HISTORY_DAYS = 7
+
+
+class DeviceIds:
+    ids = []
+    loaded_at = 0.0
+    lock = Semaphore()
+
+    @classmethod
+    def load(cls, client) -> None:
+        ids = []
+        after_id = None
+        while True:
+            params = {"limit": DEVICE_IDS_PAGE}
+            if after_id is not None:
+                params["after_id"] = after_id
+            resp = client.get("/devices/", params=params, name="/devices/ [cache]")
+            if resp.status_code != 200:
+                break
+            page = resp.json()
+            ids += page["device_ids"]
+            after_id = page.get("next_after_id")
+            if after_id is None:
+                break
+        cls.ids = ids
+        cls.loaded_at = time.monotonic()
+
+    @classmethod
+    def get(cls, client) -> list[int]:
+        if not cls.ids or time.monotonic() - cls.loaded_at > DEVICE_IDS_REFRESH:
+            with cls.lock:
+                if not cls.ids or time.monotonic() - cls.loaded_at > DEVICE_IDS_REFRESH:
+                    cls.load(client)
+        return cls.ids
+
+    @classmethod
+    def add(cls, device_id: int) -> None:
+        cls.ids.append(device_id)
+
+
+def utc_now() -> str:
+    return datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+
+
+def utc_iso(timestamp: float) -> str:
+    date = datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+    return date.isoformat(timespec="seconds")
+
+
+def id_range(value: str) -> range:
+    first, _, last = value.partition("-")
+    return range(int(first), int(last or first) + 1)
+
+
+class ProfileUser(HttpUser):
+    abstract = True
+    wait_time = between(0.5, 1.5)
+
+    def random_device_id(self) -> int:
+        return random.choice(DeviceIds.get(self.client))
+
+    def random_window(self, hours: float) -> dict:
+        # A window of the given length inside the last WINDOW_HISTORY_DAYS.
+        end = time.time() - random.uniform(
+            0, WINDOW_HISTORY_DAYS * 86400 - hours * 3600
+        )
+        begin = end - hours * 3600
+        return {"begin": utc_iso(begin), "end": utc_iso(end)}
+
+
+class RegisteredUser(ProfileUser):
+    # Registers, logs in and adds one device, like the interactive scenarios.
+    abstract = True
+
+    def on_start(self):
+        suffix = f"{random.getrandbits(48):x}"
+        login = "login" + suffix
+        password = "password" + suffix
+        resp = self.client.post(
+            "/add_user/", json={"login": login, "password": password}
+        )
+        self.user_id = resp.json()["id"]
+        resp = self.client.post(
+            "/login",
+            data={"username": login, "password": password},
+            headers={"content-type": "application/x-www-form-urlencoded"},
+        )
+        token = resp.json()["access_token"]
+        self.auth_header = {"Authorization": "Bearer " + token}
+        self.device_id = random.randrange(1, 2**31)
+        self.client.post(
+            "/add_device/", json={"id": self.device_id}, headers=self.auth_header
+        )
+        DeviceIds.add(self.device_id)
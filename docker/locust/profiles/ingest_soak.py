@@ -0,0 +1,35 @@
+import os
+import random
+
+from common import ProfileUser, utc_now
+from locust import constant_throughput, task
+
+# Profile v1: sustained ingest at a fixed request rate per user against the
+# devices that already exist, to watch latency and memory over a long run.
+BATCH_SIZE = int(os.environ.get("LOCUST_BATCH_SIZE", 100))
+
+
+class IngestSoakUser(ProfileUser):
+    wait_time = constant_throughput(10)
+
+    @task(9)
+    def new_device_data(self):
+        self.client.get(
+            f"/new_device_data/{self.random_device_id()}",
+            name="/new_device_data/[id]",
+        )
+
+    @task(1)
+    def device_data_batch(self):
+        date = utc_now()
+        data = [
+            {
+                "device_id": self.random_device_id(),
+                "x": random.uniform(10, 100),
+                "y": random.uniform(10, 100),
+                "z": random.uniform(10, 100),
+                "date": date,
+            }
+            for _ in range(BATCH_SIZE)
+        ]
+        self.client.post("/device_data/batch", json={"data": data})
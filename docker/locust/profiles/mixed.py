@@ -0,0 +1,66 @@
+import random
+
+from common import RegisteredUser, utc_now
+from locust import task
+
+# Profile v1: a weighted mix of ingest, auth and analysis by registered users.
+
+
+class MixedUser(RegisteredUser):
+    @task(40)
+    def new_device_data(self):
+        self.client.get(
+            f"/new_device_data/{self.random_device_id()}",
+            name="/new_device_data/[id]",
+        )
+
+    @task(10)
+    def device_data_batch(self):
+        date = utc_now()
+        data = [
+            {
+                "device_id": self.device_id,
+                "x": random.uniform(10, 100),
+                "y": random.uniform(10, 100),
+                "z": random.uniform(10, 100),
+                "date": date,
+            }
+            for _ in range(10)
+        ]
+        self.client.post("/device_data/batch", json={"data": data})
+
+    @task(15)
+    def current_user(self):
+        self.client.get("/users/me", headers=self.auth_header)
+
+    @task(20)
+    def device_analysis(self):
+        self.client.get(
+            "/device_data_analysis/",
+            params={"device_id": self.random_device_id()},
+            name="/device_data_analysis/?device_id",
+        )
+
+    @task(5)
+    def device_window_analysis(self):
+        params = {"device_id": self.random_device_id(), **self.random_window(1)}
+        self.client.get(
+            "/device_data_analysis/",
+            params=params,
+            name="/device_data_analysis/?device_id&window",
+        )
+
+    @task(5)
+    def user_analysis(self):
+        self.client.get(
+            "/device_data_analysis/",
+            params={"user_id": self.user_id},
+            name="/device_data_analysis/?user_id",
+        )
+
+    @task(5)
+    def device_series(self):
+        self.client.get(
+            f"/device_data/{self.random_device_id()}/series",
+            name="/device_data/[id]/series",
+        )